@@ -0,0 +1,135 @@
+"""
+Batched counterpart of dinkaugment: the same family of transforms applied to a whole
+N x C x H x W batch with tensor ops, on the device the batch lives on.
+Every transform is drawn independently per sample with probability u.
+"""
+import math
+import torch
+import torch.nn.functional as F
+
+
+def _select(u, n, device):
+    return torch.rand(n, device=device) < u
+
+def _uniform(low, high, n, device):
+    return torch.empty(n, device=device).uniform_(low, high)
+
+def bgr2hsv(image):
+    # h in sextants [0, 6), s and v in [0, 1]
+    b, g, r = image.unbind(1)
+    value, argmax = image.max(1)
+    chroma = value - image.min(1)[0]
+    safe = torch.where(chroma > 0, chroma, torch.ones_like(chroma))
+    hue = torch.where(argmax == 2, ((g - b) / safe) % 6,
+          torch.where(argmax == 1, (b - r) / safe + 2, (r - g) / safe + 4))
+    hue = torch.where(chroma > 0, hue, torch.zeros_like(hue))
+    saturation = torch.where(value > 0, chroma / torch.where(value > 0, value, torch.ones_like(value)), torch.zeros_like(value))
+    return hue, saturation, value
+
+def hsv2bgr(hue, saturation, value):
+    def channel(n):
+        k = (n + hue) % 6
+        return value - value * saturation * torch.clamp(torch.minimum(k, 4 - k), 0, 1)
+    return torch.stack((channel(1), channel(3), channel(5)), 1)
+
+def randomHueSaturationValue(image, hue_shift_limit=(-100, 100),
+                             sat_shift_limit=(-100, 100),
+                             val_shift_limit=(-100, 100), u=0.5):
+    # Limits are in OpenCV's uint8 HSV units (hue in 2 degree steps, s and v out of 255).
+    # Unlike dinkaugment, hue wraps around the colour circle instead of at 256.
+    n, device = image.size(0), image.device
+    selected = _select(u, n, device)
+    if not selected.any():
+        return image
+    hue_shift = torch.randint(hue_shift_limit[0], hue_shift_limit[1] + 1, (n,), device=device).float() * 2 / 60
+    sat_shift = _uniform(sat_shift_limit[0], sat_shift_limit[1], n, device) / 255
+    val_shift = _uniform(val_shift_limit[0], val_shift_limit[1], n, device) / 255
+
+    hue, saturation, value = bgr2hsv(image)
+    hue = (hue + hue_shift.view(-1, 1, 1)) % 6
+    saturation = (saturation + sat_shift.view(-1, 1, 1)).clamp_(0, 1)
+    value = (value + val_shift.view(-1, 1, 1)).clamp_(0, 1)
+    return torch.where(selected.view(-1, 1, 1, 1), hsv2bgr(hue, saturation, value), image)
+
+def randomShiftScaleRotate(image, mask,
+                           shift_limit=(-0.0, 0.0),
+                           scale_limit=(-0.0, 0.0),
+                           rotate_limit=(-0.0, 0.0),
+                           aspect_limit=(-0.0, 0.0), u=0.5):
+    n, device = image.size(0), image.device
+    selected = _select(u, n, device)
+    if not selected.any():
+        return image, mask
+    height, width = image.shape[2:]
+
+    angle = _uniform(rotate_limit[0], rotate_limit[1], n, device) / 180 * math.pi
+    scale = _uniform(1 + scale_limit[0], 1 + scale_limit[1], n, device)
+    aspect = _uniform(1 + aspect_limit[0], 1 + aspect_limit[1], n, device)
+    sx = scale * aspect / aspect.sqrt()
+    sy = scale / aspect.sqrt()
+    dx = _uniform(shift_limit[0], shift_limit[1], n, device).mul_(width).round_()
+    dy = _uniform(shift_limit[0], shift_limit[1], n, device).mul_(height).round_()
+
+    # Forward map about the tile centre as in dinkaugment, in grid_sample's [-1, 1] coordinates,
+    # then inverted because grid_sample looks up the source location of every output pixel
+    cc = angle.cos() * sx
+    ss = angle.sin() * sy
+    forward = torch.zeros(n, 3, 3, device=device)
+    forward[:, 0, 0] = cc
+    forward[:, 0, 1] = -ss * height / width
+    forward[:, 1, 0] = ss * width / height
+    forward[:, 1, 1] = cc
+    forward[:, 0, 2] = dx * 2 / width
+    forward[:, 1, 2] = dy * 2 / height
+    forward[:, 2, 2] = 1
+    theta = torch.linalg.inv(forward[selected])[:, :2]
+
+    grid = F.affine_grid(theta, [len(theta), 1, height, width], align_corners=False)
+    image = image.clone()
+    mask = mask.clone()
+    image[selected] = F.grid_sample(image[selected], grid.to(image.dtype), mode='bilinear', align_corners=False)
+    mask[selected] = F.grid_sample(mask[selected], grid.to(mask.dtype), mode='nearest', align_corners=False)
+    return image, mask
+
+def randomHorizontalFlip(image, mask, u=0.5):
+    selected = _select(u, image.size(0), image.device).view(-1, 1, 1, 1)
+    return torch.where(selected, image.flip(3), image), torch.where(selected, mask.flip(3), mask)
+
+def randomVerticleFlip(image, mask, u=0.5):
+    selected = _select(u, image.size(0), image.device).view(-1, 1, 1, 1)
+    return torch.where(selected, image.flip(2), image), torch.where(selected, mask.flip(2), mask)
+
+def randomRotate90(image, mask, u=0.5):
+    # Counter-clockwise like np.rot90; only square tiles keep their shape
+    if image.size(2) != image.size(3):
+        return image, mask
+    selected = _select(u, image.size(0), image.device).view(-1, 1, 1, 1)
+    return (torch.where(selected, image.rot90(1, (2, 3)), image),
+            torch.where(selected, mask.rot90(1, (2, 3)), mask))
+
+
+def augment(img, mask):
+    # img is N x 3 x H x W (BGR), mask N x 1 x H x W; float in [0, 1] or uint8 in [0, 255]
+    dtype = img.dtype
+    if dtype == torch.uint8:
+        img = img.float().div_(255.0)
+        mask = mask.float().div_(255.0)
+
+    img = randomHueSaturationValue(img,
+                                   hue_shift_limit=(-30, 30),
+                                   sat_shift_limit=(-5, 5),
+                                   val_shift_limit=(-15, 15))
+
+    img, mask = randomShiftScaleRotate(img, mask,
+                                       shift_limit=(-0.1, 0.1),
+                                       scale_limit=(-0.1, 0.1),
+                                       aspect_limit=(-0.1, 0.1),
+                                       rotate_limit=(-0, 0))
+    img, mask = randomHorizontalFlip(img, mask)
+    img, mask = randomVerticleFlip(img, mask)
+    img, mask = randomRotate90(img, mask)
+
+    if dtype == torch.uint8:
+        img = img.mul_(255.0).round_().to(dtype)
+        mask = mask.mul_(255.0).round_().to(dtype)
+    return img, mask
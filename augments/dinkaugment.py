@@ -6,6 +6,7 @@ import torch.utils.data as data
 from torch.autograd import Variable as V
 
 import cv2
+import math
 import numpy as np
 import os
 
@@ -13,17 +14,15 @@ def randomHueSaturationValue(image, hue_shift_limit=(-100, 100),
                              sat_shift_limit=(-100, 100),
                              val_shift_limit=(-100, 100), u=0.5):
     if np.random.random() < u:
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        h, s, v = cv2.split(image)
         hue_shift = np.random.randint(hue_shift_limit[0], hue_shift_limit[1]+1)
-        hue_shift = np.uint8(hue_shift)
-        h += hue_shift
         sat_shift = np.random.uniform(sat_shift_limit[0], sat_shift_limit[1])
-        s = cv2.add(s, sat_shift)
         val_shift = np.random.uniform(val_shift_limit[0], val_shift_limit[1])
-        v = cv2.add(v, val_shift)
-        image = cv2.merge((h, s, v))
-        #image = cv2.merge((s, v))
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        # One saturating add over all three channels instead of split, three adds and merge;
+        # hue then wraps around at 256 in place, like the uint8 addition of the original
+        image = cv2.add(image, (0, sat_shift, val_shift, 0))
+        hue = image[..., 0]
+        hue += np.uint8(hue_shift % 256)
         image = cv2.cvtColor(image, cv2.COLOR_HSV2BGR)
 
     return image
@@ -45,8 +44,8 @@ def randomShiftScaleRotate(image, mask,
         dx = round(np.random.uniform(shift_limit[0], shift_limit[1]) * width)
         dy = round(np.random.uniform(shift_limit[0], shift_limit[1]) * height)
 
-        cc = np.math.cos(angle / 180 * np.math.pi) * sx
-        ss = np.math.sin(angle / 180 * np.math.pi) * sy
+        cc = math.cos(angle / 180 * math.pi) * sx
+        ss = math.sin(angle / 180 * math.pi) * sy
         rotate_matrix = np.array([[cc, -ss], [ss, cc]])
 
         box0 = np.array([[0, 0], [width, 0], [width, height], [0, height], ])
@@ -101,6 +100,66 @@ def rotateImage(image, angle):
     return result
 
 
+def randomGeometry(image, mask,
+                   shift_limit=(-0.0, 0.0),
+                   scale_limit=(-0.0, 0.0),
+                   rotate_limit=(-0.0, 0.0),
+                   aspect_limit=(-0.0, 0.0),
+                   borderMode=cv2.BORDER_CONSTANT, u=0.5):
+    # Same draws as randomShiftScaleRotate, randomHorizontalFlip, randomVerticleFlip and
+    # randomRotate90 in sequence, composed into one 3x3 matrix so the image and the mask
+    # are resampled once instead of once per step
+    height, width = image.shape[:2]
+    matrix = np.eye(3)
+    warp = False
+    if np.random.random() < u:
+        angle = np.random.uniform(rotate_limit[0], rotate_limit[1])
+        scale = np.random.uniform(1 + scale_limit[0], 1 + scale_limit[1])
+        aspect = np.random.uniform(1 + aspect_limit[0], 1 + aspect_limit[1])
+        sx = scale * aspect / (aspect ** 0.5)
+        sy = scale / (aspect ** 0.5)
+        dx = round(np.random.uniform(shift_limit[0], shift_limit[1]) * width)
+        dy = round(np.random.uniform(shift_limit[0], shift_limit[1]) * height)
+
+        cc = math.cos(angle / 180 * math.pi) * sx
+        ss = math.sin(angle / 180 * math.pi) * sy
+        rotate_matrix = np.array([[cc, -ss], [ss, cc]])
+
+        box0 = np.array([[0, 0], [width, 0], [width, height], [0, height], ])
+        box1 = box0 - np.array([width / 2, height / 2])
+        box1 = np.dot(box1, rotate_matrix.T) + np.array([width / 2 + dx, height / 2 + dy])
+        matrix = cv2.getPerspectiveTransform(box0.astype(np.float32), box1.astype(np.float32))
+        warp = True
+    hflip = np.random.random() < u
+    vflip = np.random.random() < u
+    rot90 = np.random.random() < u
+
+    if not warp:
+        # Only flips and rotations: take views and copy once
+        if hflip:
+            image, mask = image[:, ::-1], mask[:, ::-1]
+        if vflip:
+            image, mask = image[::-1], mask[::-1]
+        if rot90:
+            image, mask = np.rot90(image), np.rot90(mask)
+        return np.ascontiguousarray(image), np.ascontiguousarray(mask)
+
+    if hflip:
+        matrix = np.array([[-1, 0, width - 1], [0, 1, 0], [0, 0, 1]]) @ matrix
+    if vflip:
+        matrix = np.array([[1, 0, 0], [0, -1, height - 1], [0, 0, 1]]) @ matrix
+    size = (width, height)
+    if rot90:
+        # np.rot90 (counter-clockwise): x' = y, y' = width - 1 - x
+        matrix = np.array([[0, 1, 0], [-1, 0, width - 1], [0, 0, 1]]) @ matrix
+        size = (height, width)
+    image = cv2.warpPerspective(image, matrix, size, flags=cv2.INTER_LINEAR, borderMode=borderMode,
+                                borderValue=(0, 0, 0,))
+    mask = cv2.warpPerspective(mask, matrix, size, flags=cv2.INTER_NEAREST, borderMode=borderMode,
+                               borderValue=(0, 0, 0,))
+    return image, mask
+
+
 def augment(img, mask):
 
     img = randomHueSaturationValue(img,
@@ -108,14 +167,11 @@ def augment(img, mask):
                                    sat_shift_limit=(-5, 5),
                                    val_shift_limit=(-15, 15))
 
-    img, mask = randomShiftScaleRotate(img, mask,
-                                       shift_limit=(-0.1, 0.1),
-                                       scale_limit=(-0.1, 0.1),
-                                       aspect_limit=(-0.1, 0.1),
-                                       rotate_limit=(-0, 0))
-    img, mask = randomHorizontalFlip(img, mask)
-    img, mask = randomVerticleFlip(img, mask)
-    img, mask = randomRotate90(img, mask)
+    img, mask = randomGeometry(img, mask,
+                               shift_limit=(-0.1, 0.1),
+                               scale_limit=(-0.1, 0.1),
+                               aspect_limit=(-0.1, 0.1),
+                               rotate_limit=(-0, 0))
     #img, mask = randomRotate(img, mask)
 
     return img, mask
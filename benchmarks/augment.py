@@ -0,0 +1,96 @@
+# Per-sample cost of the dinkaugment transforms against the implementations they replaced:
+# the chain of per-step resamplings against the composed warp in randomGeometry, and the
+# split/add/merge HSV jitter against the single-pass add in randomHueSaturationValue.
+# tests/test_augment.py checks that both HSV jitters give the same pixels.
+# Run from the repository root: python -m benchmarks.augment
+import argparse
+import time
+import cv2
+import numpy as np
+from augments import dinkaugment as da
+
+
+parser = argparse.ArgumentParser(description='augmentation benchmark')
+
+parser.add_argument('-n',   '--samples',        type=int,   required=False, dest='samples',     help='samples per measurement')
+parser.add_argument('-sz',  '--size',           type=int,   required=False, dest='size',        help='tile size in pixels')
+
+LIMITS = dict(shift_limit=(-0.1, 0.1), scale_limit=(-0.1, 0.1), aspect_limit=(-0.1, 0.1), rotate_limit=(-0, 0))
+
+def chained(img, mask):
+    img, mask = da.randomShiftScaleRotate(img, mask, **LIMITS)
+    img, mask = da.randomHorizontalFlip(img, mask)
+    img, mask = da.randomVerticleFlip(img, mask)
+    img, mask = da.randomRotate90(img, mask)
+    # The model path copies into a contiguous array anyway
+    return np.ascontiguousarray(img), np.ascontiguousarray(mask)
+
+def composed(img, mask):
+    return da.randomGeometry(img, mask, **LIMITS)
+
+HSV_LIMITS = dict(hue_shift_limit=(-30, 30), sat_shift_limit=(-5, 5), val_shift_limit=(-15, 15))
+
+def splitHueSaturationValue(image, mask, hue_shift_limit, sat_shift_limit, val_shift_limit, u=0.5):
+    # The original randomHueSaturationValue
+    if np.random.random() < u:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        h, s, v = cv2.split(image)
+        hue_shift = np.random.randint(hue_shift_limit[0], hue_shift_limit[1]+1)
+        hue_shift = np.uint8(hue_shift % 256)
+        h += hue_shift
+        sat_shift = np.random.uniform(sat_shift_limit[0], sat_shift_limit[1])
+        s = cv2.add(s, sat_shift)
+        val_shift = np.random.uniform(val_shift_limit[0], val_shift_limit[1])
+        v = cv2.add(v, val_shift)
+        image = cv2.merge((h, s, v))
+        image = cv2.cvtColor(image, cv2.COLOR_HSV2BGR)
+    return image, mask
+
+def fusedHueSaturationValue(image, mask, u=0.5, **limits):
+    return da.randomHueSaturationValue(image, u=u, **limits), mask
+
+def tile(size, seed=0):
+    rng = np.random.default_rng(seed)
+    img = cv2.GaussianBlur(rng.integers(0, 256, (size, size, 3), dtype=np.uint8), (9, 9), 4)
+    mask = np.zeros((size, size), np.uint8)
+    for _ in range(6):
+        cv2.line(mask, tuple(int(v) for v in rng.integers(0, size, 2)), tuple(int(v) for v in rng.integers(0, size, 2)), 255, size // 64 + 1)
+    return img, mask
+
+def measure(function, img, mask, samples, seed=0, repeats=3):
+    # Best of a few runs, the first one also warms caches and allocators
+    best = float('inf')
+    for _ in range(repeats):
+        np.random.seed(seed)
+        start = time.perf_counter()
+        for _ in range(samples):
+            function(img, mask)
+        best = min(best, (time.perf_counter() - start) / samples * 1000)
+    return best
+
+def compare(before, after, img, mask, samples, seed=0):
+    # Both implementations draw the same random numbers, so seeded outputs are directly comparable
+    imgdiff, maskdiff = [], []
+    for i in range(samples):
+        np.random.seed(seed + i)
+        a = before(img, mask)
+        np.random.seed(seed + i)
+        b = after(img, mask)
+        imgdiff.append(np.abs(a[0].astype(np.float32) - b[0]).mean())
+        maskdiff.append(((a[1] >= 128) != (b[1] >= 128)).mean())
+    return float(np.mean(imgdiff)), float(np.mean(maskdiff))
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    args.samples = 50 if not args.samples else args.samples
+    args.size = 1024 if not args.size else args.size
+
+    img, mask = tile(args.size)
+    old = lambda i, m: splitHueSaturationValue(i, m, u=1.0, **HSV_LIMITS)
+    new = lambda i, m: fusedHueSaturationValue(i, m, u=1.0, **HSV_LIMITS)
+    for name, before, after in [('geometry', chained, composed), ('hsv', old, new)]:
+        slow = measure(before, img, mask, args.samples)
+        fast = measure(after, img, mask, args.samples)
+        imgdiff, maskdiff = compare(before, after, img, mask, min(args.samples, 20))
+        print('{:<9}{:8.2f} -> {:8.2f} ms/sample ({:.2f}x)  mean abs image difference {:.3f} / 255, mask pixels changed {:.5f}'
+              .format(name, slow, fast, slow / fast, imgdiff, maskdiff))
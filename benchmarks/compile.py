@@ -0,0 +1,90 @@
+# Eager against compiled (compiling.compileModel) step time for the networks, with the one-off
+# warm-up cost of compiling: an inference step (as in valid.py / test.py) and a training step.
+# Every network runs in its own process, so compiled state does not leak between them; run it
+# twice to see the warm-up with a warm compile_cache/.
+# Run from the repository root: python -m benchmarks.compile -m FCDenseNet DBilinearUnet34 -sz 512
+import sys
+import json
+import time
+import argparse
+import importlib
+import subprocess
+import torch
+import torch.nn as nn
+
+
+parser = argparse.ArgumentParser(description='compiled model benchmark')
+
+parser.add_argument('-m',   '--models',         type=str,   nargs='+',      dest='models',      help='networks to measure (default FCDenseNet DBilinearUnet34 NotPreTrainedTransposeUnet34)')
+parser.add_argument('-cm',  '--compile-mode',   type=str,   required=False, dest='mode',        choices=('auto', 'compile', 'script'), help='compiling.compileModel mode (default auto)')
+parser.add_argument('-b',   '--batch',          type=int,   required=False, dest='batch',       help='batch size (default 4)')
+parser.add_argument('-sz',  '--size',           type=int,   required=False, dest='size',        help='tile size in pixels (default 512)')
+parser.add_argument('-d',   '--device',         type=str,   required=False, dest='device',      help='cpu or cuda:N (default cuda when available)')
+parser.add_argument('-r',   '--repeats',        type=int,   required=False, dest='repeats',     help='timed steps per measurement (default 5)')
+parser.add_argument('--one', type=str, help=argparse.SUPPRESS)
+
+def timed(function, device, repeats):
+    # Best of repeats, after the first call has been timed separately as the warm-up
+    def once():
+        start = time.perf_counter()
+        function()
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        return time.perf_counter() - start
+    first = once()
+    return first, min(once() for _ in range(repeats))
+
+def steps(model, criterion, inputs, labels):
+    def infer():
+        model.eval()
+        with torch.inference_mode():
+            model(inputs)
+    def train():
+        model.train()
+        criterion(model(inputs), labels).backward()
+        model.zero_grad(set_to_none=True)
+    return infer, train
+
+def measure(config):
+    device = torch.device(config['device'])
+    torch.manual_seed(0)
+    model = getattr(importlib.import_module('networks.{}'.format(config['model'])), config['model'])().to(device)
+    criterion = nn.BCELoss()
+    inputs = torch.rand(config['batch'], 3, config['size'], config['size'], device=device)
+    labels = (torch.rand(config['batch'], 1, config['size'], config['size'], device=device) > 0.9).float()
+    result = dict(config)
+    for name, step in zip(('infer', 'train'), steps(model, criterion, inputs, labels)):
+        result['eager_' + name] = timed(step, device, config['repeats'])[1]
+
+    from compiling import compileModel
+    compiled = compileModel(model, config['mode'])
+    for name, step in zip(('infer', 'train'), steps(compiled, criterion, inputs, labels)):
+        result['warmup_' + name], result['compiled_' + name] = timed(step, device, config['repeats'])
+    result['used'] = compiled.used
+    return result
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.one:
+        print(json.dumps(measure(json.loads(args.one))))
+        sys.exit(0)
+    args.models = args.models or ['FCDenseNet', 'DBilinearUnet34', 'NotPreTrainedTransposeUnet34']
+    args.mode = args.mode or 'auto'
+    args.batch = args.batch or 4
+    args.size = args.size or 512
+    args.device = args.device or ('cuda' if torch.cuda.is_available() else 'cpu')
+    args.repeats = args.repeats or 5
+
+    print('{:<30} {:<8} {:<6} {:>9} {:>9} {:>8} {:>10}'.format('model', 'mode', 'step', 'eager s', 'compiled', 'speedup', 'warm-up s'))
+    for model in args.models:
+        config = dict(model=model, mode=args.mode, batch=args.batch, size=args.size, device=args.device, repeats=args.repeats)
+        done = subprocess.run([sys.executable, '-m', 'benchmarks.compile', '--one', json.dumps(config)],
+                              stdout=subprocess.PIPE, universal_newlines=True)
+        if done.returncode != 0:
+            print('{:<30} {:<8} {:<6} {:>9}'.format(model, args.mode, '', 'failed'))
+            continue
+        result = json.loads(done.stdout.strip().splitlines()[-1])
+        for step in ('infer', 'train'):
+            eager, compiled = result['eager_' + step], result['compiled_' + step]
+            print('{:<30} {:<8} {:<6} {:>9.3f} {:>9.3f} {:>7.2f}x {:>10.1f}'.format(
+                model, result['used'], step, eager, compiled, eager / compiled, result['warmup_' + step]))
@@ -0,0 +1,74 @@
+# Equivalence and speed of networks.fusion: every network is run in eval mode with and without
+# its BatchNorms folded into the convolutions. BatchNorm statistics and affine parameters are
+# randomized first, so the folding is not checked against identity BatchNorms. Exits with 1
+# when any output differs by more than --tolerance. tests/test_fusion.py runs the same check
+# through every tester.
+# Run from the repository root: python -m benchmarks.fusion -sz 256
+import sys
+import copy
+import time
+import argparse
+import importlib
+import torch
+import torch.nn as nn
+from networks.fusion import fuse
+
+
+parser = argparse.ArgumentParser(description='Conv + BatchNorm folding check')
+
+parser.add_argument('-m',   '--models',         type=str,   nargs='+',      dest='models',      help='networks to check (default FCDenseNet DilatedDense DBilinearUnet34 NotPreTrainedTransposeUnet34 TransposeUnet)')
+parser.add_argument('-b',   '--batch',          type=int,   required=False, dest='batch',       help='batch size (default 2)')
+parser.add_argument('-sz',  '--size',           type=int,   required=False, dest='size',        help='tile size in pixels (default 256)')
+parser.add_argument('-d',   '--device',         type=str,   required=False, dest='device',      help='cpu or cuda:N (default cuda when available)')
+parser.add_argument('-cl',  '--channels-last',  action='store_true',        dest='channelsLast', help='run both models in channels_last')
+parser.add_argument('-tl',  '--tolerance',      type=float, required=False, dest='tolerance',   help='largest accepted absolute difference of the outputs (default 1e-4)')
+parser.add_argument('-r',   '--repeats',        type=int,   required=False, dest='repeats',     help='timed forwards per model (default 5)')
+
+def randomizeNorms(model):
+    for m in model.modules():
+        if isinstance(m, nn.BatchNorm2d):
+            m.running_mean.uniform_(-0.5, 0.5)
+            m.running_var.uniform_(0.5, 2.0)
+            m.weight.data.uniform_(0.5, 1.5)
+            m.bias.data.uniform_(-0.5, 0.5)
+
+def timed(model, inputs, device, repeats):
+    model(inputs)
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model(inputs)
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    args.models = args.models or ['FCDenseNet', 'DilatedDense', 'DBilinearUnet34', 'NotPreTrainedTransposeUnet34', 'TransposeUnet']
+    args.batch = args.batch or 2
+    args.size = args.size or 256
+    args.device = args.device or ('cuda' if torch.cuda.is_available() else 'cpu')
+    args.tolerance = args.tolerance or 1e-4
+    args.repeats = args.repeats or 5
+    device = torch.device(args.device)
+    memoryFormat = torch.channels_last if args.channelsLast else torch.contiguous_format
+
+    failed = False
+    print('{:<30} {:>7} {:>10} {:>10} {:>9} {:>8}'.format('model', 'folded', 'max diff', 'plain s', 'fused s', 'speedup'))
+    for name in args.models:
+        torch.manual_seed(0)
+        model = getattr(importlib.import_module('networks.{}'.format(name)), name)()
+        randomizeNorms(model)
+        model.to(device, memory_format=memoryFormat).eval()
+        fused = copy.deepcopy(model)
+        folded = fuse(fused)
+        inputs = torch.rand(args.batch, 3, args.size, args.size, device=device).contiguous(memory_format=memoryFormat)
+        with torch.inference_mode():
+            difference = (model(inputs) - fused(inputs)).abs().max().item()
+            plain = timed(model, inputs, device, args.repeats)
+            fast = timed(fused, inputs, device, args.repeats)
+        failed = failed or difference > args.tolerance
+        print('{:<30} {:>7} {:>10.2e} {:>10.3f} {:>9.3f} {:>7.2f}x{}'.format(
+            name, folded, difference, plain, fast, plain / fast, '  MISMATCH' if difference > args.tolerance else ''))
+    sys.exit(1 if failed else 0)
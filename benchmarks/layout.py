@@ -0,0 +1,72 @@
+# Throughput of every network with NCHW (contiguous) against NHWC (channels_last) weights and
+# batches, for an inference step as in valid.py / test.py and for a training step.
+# Run from the repository root: python -m benchmarks.layout -m FCDenseNet DBilinearUnet34 -b 4 -sz 512
+import time
+import argparse
+import importlib
+import torch
+import torch.nn as nn
+from precision import PRECISIONS, autocast, autocastSafe, criterionFloat32
+
+
+parser = argparse.ArgumentParser(description='memory format benchmark')
+
+parser.add_argument('-m',   '--models',         type=str,   nargs='+',      dest='models',      help='networks to measure (default FCDenseNet DilatedDense DBilinearUnet34 NotPreTrainedTransposeUnet34)')
+parser.add_argument('-b',   '--batch',          type=int,   required=False, dest='batch',       help='batch size (default 4)')
+parser.add_argument('-sz',  '--size',           type=int,   required=False, dest='size',        help='tile size in pixels (default 512)')
+parser.add_argument('-d',   '--device',         type=str,   required=False, dest='device',      help='cpu or cuda:N (default cuda when available)')
+parser.add_argument('-pr',  '--precision',      type=str,   required=False, dest='precision',   choices=PRECISIONS, default='fp32', help='autocast precision')
+parser.add_argument('-r',   '--repeats',        type=int,   required=False, dest='repeats',     help='timed steps per measurement (default 5)')
+
+def throughput(step, batch, device, repeats):
+    # Images per second of the best of repeats, after one untimed warm-up step
+    step()
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        step()
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        best = min(best, time.perf_counter() - start)
+    return batch / best
+
+def measure(name, memoryFormat, args):
+    device = torch.device(args.device)
+    torch.manual_seed(0)
+    model = getattr(importlib.import_module('networks.{}'.format(name)), name)()
+    if args.precision != 'fp32':
+        autocastSafe(model)
+    model.to(device, memory_format=memoryFormat)
+    criterion = nn.BCELoss()
+    inputs = torch.rand(args.batch, 3, args.size, args.size, device=device).contiguous(memory_format=memoryFormat)
+    labels = (torch.rand(args.batch, 1, args.size, args.size, device=device) > 0.9).float()
+
+    def infer():
+        with torch.inference_mode(), autocast(device, args.precision):
+            model(inputs)
+    def train():
+        with autocast(device, args.precision):
+            loss = criterionFloat32(criterion, model(inputs), labels)
+        loss.backward()
+        model.zero_grad(set_to_none=True)
+
+    model.eval()
+    inferRate = throughput(infer, args.batch, device, args.repeats)
+    model.train()
+    trainRate = throughput(train, args.batch, device, args.repeats)
+    return inferRate, trainRate
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    args.models = args.models or ['FCDenseNet', 'DilatedDense', 'DBilinearUnet34', 'NotPreTrainedTransposeUnet34']
+    args.batch = args.batch or 4
+    args.size = args.size or 512
+    args.device = args.device or ('cuda' if torch.cuda.is_available() else 'cpu')
+    args.repeats = args.repeats or 5
+
+    print('{:<30} {:<6} {:>12} {:>12} {:>8}'.format('model', 'step', 'NCHW img/s', 'NHWC img/s', 'speedup'))
+    for name in args.models:
+        contiguous = measure(name, torch.contiguous_format, args)
+        channelsLast = measure(name, torch.channels_last, args)
+        for step, before, after in zip(('infer', 'train'), contiguous, channelsLast):
+            print('{:<30} {:<6} {:>12.2f} {:>12.2f} {:>7.2f}x'.format(name, step, before, after, after / before))
@@ -0,0 +1,99 @@
+# Peak memory and step time of one training step with and without networks.checkpointing and
+# the shared-buffer DenseBlock (layers.memoryEfficient, mode 'shared').
+# Every configuration runs in its own process so peaks do not leak between them. On CUDA the
+# peak is torch.cuda.max_memory_allocated, on CPU the growth of the peak resident set size.
+# Run from the repository root: python -m benchmarks.memory -m FCDenseNet -b 4 8 -sz 512
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import importlib
+import subprocess
+import torch
+import torch.nn as nn
+
+
+parser = argparse.ArgumentParser(description='activation memory benchmark')
+
+parser.add_argument('-m',   '--models',         type=str,   nargs='+',      dest='models',      help='networks to measure (default FCDenseNet DilatedDense NotPreTrainedTransposeUnet34)')
+parser.add_argument('-g',   '--granularities',  type=str,   nargs='+',      dest='granularities', help='none, blocks, stages and/or shared (default all)')
+parser.add_argument('-b',   '--batches',        type=int,   nargs='+',      dest='batches',     help='batch sizes (default 4)')
+parser.add_argument('-sz',  '--size',           type=int,   required=False, dest='size',        help='tile size in pixels (default 512)')
+parser.add_argument('-d',   '--device',         type=str,   required=False, dest='device',      help='cpu or cuda:N (default cuda when available)')
+parser.add_argument('-r',   '--repeats',        type=int,   required=False, dest='repeats',     help='timed steps after the measured one (default 3)')
+parser.add_argument('--one', type=str, help=argparse.SUPPRESS)
+
+def residentBytes():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def step(model, criterion, inputs, labels):
+    loss = criterion(model(inputs), labels)
+    loss.backward()
+    model.zero_grad(set_to_none=True)
+
+def measure(config):
+    device = torch.device(config['device'])
+    model = getattr(importlib.import_module('networks.{}'.format(config['model'])), config['model'])()
+    if config['granularity'] == 'shared':
+        from networks.layers import memoryEfficient
+        memoryEfficient(model)
+    elif config['granularity'] != 'none':
+        from networks import checkpointing
+        checkpointing.enable(model, config['granularity'])
+    model.to(device).train()
+    criterion = nn.BCELoss()
+    inputs = torch.rand(config['batch'], 3, config['size'], config['size'], device=device)
+    labels = (torch.rand(config['batch'], 1, config['size'], config['size'], device=device) > 0.9).float()
+
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        base = torch.cuda.memory_allocated(device)
+        step(model, criterion, inputs, labels)
+        peak = torch.cuda.max_memory_allocated(device) - base
+    else:
+        base = residentBytes()
+        step(model, criterion, inputs, labels)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - base
+
+    seconds = []
+    for _ in range(config['repeats']):
+        start = time.perf_counter()
+        step(model, criterion, inputs, labels)
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        seconds.append(time.perf_counter() - start)
+    return dict(config, peak_mb=peak / 2**20, step_seconds=min(seconds) if seconds else None)
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.one:
+        print(json.dumps(measure(json.loads(args.one))))
+        sys.exit(0)
+    args.models = args.models or ['FCDenseNet', 'DilatedDense', 'NotPreTrainedTransposeUnet34']
+    args.granularities = args.granularities or ['none', 'blocks', 'stages', 'shared']
+    args.batches = args.batches or [4]
+    args.size = args.size or 512
+    args.device = args.device or ('cuda' if torch.cuda.is_available() else 'cpu')
+    args.repeats = 3 if args.repeats is None else args.repeats
+
+    print('{:<30} {:<8} {:>5} {:>10} {:>8} {:>9}'.format('model', 'mode', 'batch', 'peak MB', 'saved', 'step s'))
+    for model in args.models:
+        for batch in args.batches:
+            baseline = None
+            for granularity in args.granularities:
+                config = dict(model=model, granularity=granularity, batch=batch, size=args.size,
+                              device=args.device, repeats=args.repeats)
+                done = subprocess.run([sys.executable, '-m', 'benchmarks.memory', '--one', json.dumps(config)],
+                                      stdout=subprocess.PIPE, universal_newlines=True)
+                if done.returncode != 0:
+                    print('{:<30} {:<8} {:>5} {:>10}'.format(model, granularity, batch, 'failed'))
+                    continue
+                result = json.loads(done.stdout.strip().splitlines()[-1])
+                baseline = result['peak_mb'] if granularity == 'none' else baseline
+                saved = '{:.0%}'.format(1 - result['peak_mb'] / baseline) if baseline and granularity != 'none' else ''
+                seconds = '{:.3f}'.format(result['step_seconds']) if result['step_seconds'] else '-'
+                print('{:<30} {:<8} {:>5} {:>10.0f} {:>8} {:>9}'.format(model, granularity, batch, result['peak_mb'], saved, seconds))
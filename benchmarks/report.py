@@ -0,0 +1,38 @@
+# Side-by-side summary of train.py -bm reports, one row per model / loss / configuration.
+# Run from the repository root: python -m benchmarks.report reports/*.json
+import argparse
+import json
+
+
+parser = argparse.ArgumentParser(description='time-to-target report summary')
+
+parser.add_argument('reports', type=str, nargs='+', help='JSON files written by train.py -bm')
+
+def summarize(report):
+    series = report['series']
+    full = [point for point in series if not point['subset']] or series
+    last = series[-1] if series else {}
+    return dict(model=report['model'], loss=report['loss'], device=report['device'], world=report['world'],
+                precision=report['config'].get('precision'), batch=report['config'].get('batch'),
+                target=report['target_iou'], reached=report['reached'], time_to_target=report['time_to_target'],
+                best_iou=max((point['val_iou'] for point in full), default=None),
+                images_per_sec=last.get('images_per_sec'), seconds=last.get('seconds'))
+
+def cell(value):
+    if isinstance(value, float):
+        return '{:.4g}'.format(value)
+    return '-' if value is None else str(value)
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    rows = []
+    for path in args.reports:
+        with open(path) as f:
+            rows.append(summarize(json.load(f)))
+    # Runs that reached the target first, fastest first; the rest by best IoU
+    rows.sort(key=lambda row: (not row['reached'], row['time_to_target'] or 0, -(row['best_iou'] or 0)))
+    columns = list(rows[0]) if rows else []
+    widths = [max(len(column), *(len(cell(row[column])) for row in rows)) for column in columns]
+    print('  '.join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(cell(row[column]).ljust(width) for column, width in zip(columns, widths)))
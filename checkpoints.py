@@ -0,0 +1,162 @@
+# Keeps the best k checkpoints per metric. State dicts are copied to the CPU on the calling
+# thread and written by a background thread, so training only waits for the copy, never the disk.
+import os
+import json
+import queue
+import random
+import atexit
+import threading
+import numpy as np
+import torch
+
+
+INDEX = 'checkpoints.json'
+
+def snapshot(state):
+    # CPU copy of a (possibly nested) state dict; the model keeps training while it is written
+    if torch.is_tensor(state):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return type(state)((key, snapshot(value)) for key, value in state.items())
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot(value) for value in state)
+    return state
+
+def atomicSave(obj, path):
+    # Readers only ever see the previous file or the complete new one
+    tmp = path + '.tmp'
+    torch.save(obj, tmp)
+    os.replace(tmp, path)
+
+def rngState():
+    # Every generator the training process draws from, for an exact restart
+    return dict(python=random.getstate(), numpy=np.random.get_state(), torch=torch.get_rng_state(),
+                cuda=torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None)
+
+def setRngState(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if state['cuda'] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+def loadTrainingState(path):
+    # The dict queued by Checkpoints.saveState; it holds numpy RNG state, so not weights_only.
+    # Kept on the CPU, where the RNG states have to be: load_state_dict moves the weights and the
+    # optimizer state to their device
+    return torch.load(path, map_location='cpu', weights_only=False)
+
+def readIndex(root='weights'):
+    # {metric: {'mode': 'min'|'max', 'entries': [{'file', 'value', 'epoch', 'optimizer'}, ...]}}
+    # with entries best first, or {} when nothing has been saved into root yet
+    path = os.path.join(root, INDEX)
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+class Checkpoints:
+
+    def __init__(self, root='weights', optimizers='optimizers', keep=1, fresh=True):
+        self.root = root
+        self.optimizers = optimizers
+        self.keep = keep
+        self.index = readIndex(root)
+        # A fresh run ranks its metrics from scratch; files an earlier run indexed under the
+        # same metric stay on disk but leave the index. Other metrics are left untouched.
+        self.fresh = set() if fresh else None
+        self.queue = queue.Queue()
+        self.error = None
+        os.makedirs(root, exist_ok=True)
+        os.makedirs(optimizers, exist_ok=True)
+        self.thread = threading.Thread(target=self.run, name='checkpoints', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def best(self, metric):
+        entries = self.index.get(metric, {}).get('entries')
+        return entries[0] if entries else None
+
+    def qualifies(self, metric, value, mode='min'):
+        # Whether value would enter the top-k of metric
+        entries = self.index.get(metric, {}).get('entries', [])
+        if len(entries) < self.keep:
+            return True
+        worst = entries[-1]['value']
+        return value < worst if mode == 'min' else value > worst
+
+    def save(self, metric, value, name, state, optimizerState=None, epoch=None, mode='min'):
+        # Queues weights/<name> (and optimizers/<name>) if value enters the top-k of metric,
+        # pruning whatever drops out; returns whether it was queued
+        self.raiseError()
+        if self.fresh is not None and metric not in self.fresh:
+            self.fresh.add(metric)
+            self.index.pop(metric, None)
+        if not self.qualifies(metric, value, mode):
+            return False
+        entry = dict(file=os.path.join(self.root, name), value=value, epoch=epoch,
+                     optimizer=os.path.join(self.optimizers, name) if optimizerState is not None else None)
+        record = self.index.setdefault(metric, dict(mode=mode, entries=[]))
+        # A checkpoint with the same name is overwritten rather than kept twice
+        entries = [old for old in record['entries'] if old['file'] != entry['file']] + [entry]
+        entries.sort(key=lambda old: old['value'], reverse=mode == 'max')
+        record['entries'], dropped = entries[:self.keep], entries[self.keep:]
+
+        states = [(entry['file'], snapshot(state))]
+        if optimizerState is not None:
+            states.append((entry['optimizer'], snapshot(optimizerState)))
+        self.queue.put((states, dropped, json.dumps(self.index, indent=1)))
+        return True
+
+    def saveState(self, name, state):
+        # Queues weights/<name> outside the top-k bookkeeping, replacing the previous one
+        self.raiseError()
+        path = os.path.join(self.root, name)
+        self.queue.put(([(path, snapshot(state))], [], None))
+        return path
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                if self.error is None:
+                    self.write(*job)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def write(self, states, dropped, index):
+        for path, state in states:
+            atomicSave(state, path)
+        if index is None:
+            return
+        # Files still referenced by another entry (of any metric) are kept
+        kept = {entry[key] for record in json.loads(index).values() for entry in record['entries']
+                for key in ('file', 'optimizer')}
+        for entry in dropped:
+            for path in (entry['file'], entry['optimizer']):
+                if path and path not in kept and os.path.exists(path):
+                    os.remove(path)
+        tmp = os.path.join(self.root, INDEX + '.tmp')
+        with open(tmp, 'w') as f:
+            f.write(index)
+        os.replace(tmp, os.path.join(self.root, INDEX))
+
+    def raiseError(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('writing a checkpoint failed') from error
+
+    def wait(self):
+        # Blocks until everything queued so far is on disk
+        self.queue.join()
+        self.raiseError()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.raiseError()
@@ -0,0 +1,110 @@
+# Opt-in compiled forward for the networks: torch.compile, or a TorchScript trace when compile
+# is unavailable or fails. Shared by train.py, valid.py, test.py and benchmarks/compile.py.
+import os
+import time
+import torch
+import torch.nn as nn
+from networks.checkpointing import frozenStats
+
+MODES = ('auto', 'compile', 'script')
+CACHE = 'compile_cache'
+
+def useCache(directory=CACHE):
+    # Inductor keeps compiled kernels and FX graphs here across runs, so only the first run of a
+    # network at a given shape pays the full compile time; must be set before the first compile
+    directory = os.path.abspath(directory)
+    os.makedirs(directory, exist_ok=True)
+    os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', os.path.join(directory, 'inductor'))
+    os.environ.setdefault('TORCHINDUCTOR_FX_GRAPH_CACHE', '1')
+    return directory
+
+def compileErrors():
+    # Failures of compiling itself: the backend (inductor and the C++/Triton toolchain under it)
+    # or dynamo giving up on the code. Errors raised by running the network are not among them
+    from torch._dynamo import exc
+    names = ('BackendCompilerFailed', 'Unsupported', 'InternalTorchDynamoError', 'InvalidBackend')
+    return tuple(getattr(exc, name) for name in names if hasattr(exc, name))
+
+class Compiled:
+    '''
+    Stands in for a model everywhere the scripts use one: attributes (parameters, state_dict,
+    train/eval, module, no_sync, ...) come from the wrapped model, calls go through the
+    compiled forward. Calls keep their shapes stable: in eval mode a batch smaller than `batch`
+    is zero-padded up to it and the output cut back, so a short last batch does not trigger a
+    recompile. Training batches are passed through as they are.
+    '''
+    def __init__(self, model, mode='auto', batch=None):
+        if isinstance(model, nn.DataParallel) and len(model.device_ids) > 1:
+            raise ValueError('compiling needs a single device per process, use -ddp for several GPUs')
+        used = 'script' if mode == 'script' or not hasattr(torch, 'compile') else 'compile'
+        if used == 'script' and mode == 'compile':
+            raise RuntimeError('torch.compile needs torch 2.0 or newer')
+        self.__dict__.update(model=model, mode=mode, batch=batch, used=used, traced={}, warmup={})
+        if used == 'compile':
+            # The network's own forward is replaced, so state_dict keys and checkpoints stay as
+            # they are and a DataParallel/DDP wrapper (and train.py's validation through .module)
+            # calls the compiled one; deleting the attribute restores the class's forward
+            target = self.target()
+            target.forward = torch.compile(target.forward, dynamic=False)
+
+    def target(self):
+        return getattr(self.model, 'module', self.model)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def __setattr__(self, name, value):
+        if name in self.__dict__:
+            self.__dict__[name] = value
+        else:
+            setattr(self.model, name, value)
+
+    def __call__(self, x):
+        count = x.size(0)
+        if self.batch and not self.model.training and count < self.batch:
+            x = torch.cat([x, x.new_zeros((self.batch - count,) + x.shape[1:])])
+        out = self.run(x)
+        return out[:count] if out.size(0) != count else out
+
+    forward = __call__
+
+    def run(self, x):
+        key = (self.model.training, tuple(x.shape), x.dtype, torch.is_autocast_enabled(x.device.type))
+        first = key not in self.warmup
+        start = time.perf_counter() if first else None
+        if self.used == 'compile':
+            try:
+                out = self.model(x)
+            except compileErrors() as e:
+                # Only on the call that compiles this shape; anything raised once it has compiled
+                # (out of memory, bad inputs) is an error of the network, not of compiling
+                if self.mode == 'compile' or not first:
+                    raise
+                print('[!] torch.compile failed ({}), falling back to TorchScript'.format(type(e).__name__))
+                del self.target().forward
+                torch._dynamo.reset()
+                self.used = 'script'
+                return self.run(x)
+        else:
+            out = self.script(key, x)
+        if start is not None:
+            self.warmup[key] = time.perf_counter() - start
+        return out
+
+    def script(self, key, x):
+        # One trace per mode/shape/dtype: a trace freezes BatchNorm/Dropout behaviour and the
+        # autocast casts it was recorded with. Traced graphs share the model's parameters; the
+        # tracing forward itself must not move BatchNorm running statistics.
+        if isinstance(self.model, nn.parallel.DistributedDataParallel):
+            raise ValueError('the TorchScript fallback cannot run under -ddp')
+        if key not in self.traced:
+            with frozenStats(self.target()):
+                self.traced[key] = torch.jit.trace(self.target(), x, check_trace=False)
+        return self.traced[key](x)
+
+def compileModel(model, mode='auto', batch=None, cache=CACHE):
+    if mode not in MODES:
+        raise ValueError('compile mode must be one of {}, got {}'.format(MODES, mode))
+    if cache:
+        useCache(cache)
+    return Compiled(model, mode, batch)
@@ -0,0 +1,56 @@
+# Device selection shared by train.py, valid.py, test.py and the testers
+import os
+import torch
+import torch.nn as nn
+
+
+def resolve(device=None, ids=None):
+    # --device wins, then the first of the -dv gpu indices, then whatever is available
+    if device:
+        return torch.device(device)
+    if ids:
+        return torch.device('cuda', ids[0])
+    return torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+def configureCpu(threads=None, interop=None):
+    # Intra-op threads split a single conv across cores; inter-op threads run independent ops
+    # concurrently, which these sequential networks barely use. Must run before any parallel work.
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    torch.set_num_threads(threads or cores)
+    try:
+        torch.set_num_interop_threads(interop or 1)
+    except RuntimeError:
+        # Already set, or inter-op work has already started in this process
+        pass
+
+def place(model, device, ids=None, channelsLast=False):
+    # On CUDA the model is wrapped in DataParallel as before; on CPU it stays unwrapped and
+    # stateDict/loadState keep checkpoints in the 'module.'-prefixed DataParallel layout
+    if channelsLast:
+        model = model.to(memory_format=torch.channels_last)
+    if device.type == 'cuda':
+        torch.cuda.set_device(device)
+        model = nn.DataParallel(model, device_ids=ids or [device.index or 0])
+    return model.to(device)
+
+def stateDict(model):
+    state = model.state_dict()
+    if hasattr(model, 'module'):
+        return state
+    return type(state)(('module.' + key, value) for key, value in state.items())
+
+def loadState(model, state):
+    # Accepts checkpoints with or without the 'module.' prefix for wrapped and plain models
+    wrapped = hasattr(model, 'module')
+    prefixed = all(key.startswith('module.') for key in state)
+    if wrapped and not prefixed:
+        state = type(state)(('module.' + key, value) for key, value in state.items())
+    elif prefixed and not wrapped:
+        state = type(state)((key[len('module.'):], value) for key, value in state.items())
+    return model.load_state_dict(state)
+
+def toDevice(array, device, memoryFormat=torch.contiguous_format):
+    # float NCHW array from the testers onto the device, in the memory format the model uses.
+    # The testers build it as a transposed view of cv2's HWC images, which numpy keeps NHWC in
+    # memory, so for channels_last both steps keep the layout instead of copying.
+    return torch.from_numpy(array).to(device).contiguous(memory_format=memoryFormat)
@@ -0,0 +1,72 @@
+# Multi-process training on top of torch.distributed. Processes are started either by
+# torchrun or by spawn() below, which sets the same environment variables torchrun does.
+import os
+import sys
+import socket
+import subprocess
+import torch
+import torch.distributed as dist
+
+
+def launched():
+    # True inside a process started by torchrun or spawn()
+    return 'RANK' in os.environ and 'WORLD_SIZE' in os.environ
+
+def setup(backend):
+    dist.init_process_group(backend=backend, init_method='env://')
+    return dist.get_rank(), dist.get_world_size()
+
+def cleanup():
+    if dist.is_initialized():
+        dist.destroy_process_group()
+
+def isMain():
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+def average(value, device=None):
+    # Mean of a python number or tensor over all processes, returned as a python float
+    if not dist.is_initialized():
+        return float(value)
+    device = device if device is not None else ('cuda' if dist.get_backend() == 'nccl' else 'cpu')
+    tensor = torch.as_tensor(value, dtype=torch.float64, device=device).clone()
+    dist.all_reduce(tensor)
+    return tensor.item() / dist.get_world_size()
+
+def freePort():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def spawn(nproc, argv=None):
+    # Runs `python argv` nproc times on this machine as ranks 0..nproc-1 and returns the
+    # first non-zero exit code; the remaining ranks are stopped when one of them fails
+    argv = sys.argv if argv is None else argv
+    port = str(freePort())
+    processes = []
+    for rank in range(nproc):
+        env = dict(os.environ, RANK=str(rank), LOCAL_RANK=str(rank), WORLD_SIZE=str(nproc),
+                   LOCAL_WORLD_SIZE=str(nproc), MASTER_ADDR='127.0.0.1', MASTER_PORT=port)
+        processes.append(subprocess.Popen([sys.executable] + argv, env=env))
+
+    code = 0
+    try:
+        while processes:
+            for process in list(processes):
+                status = process.poll()
+                if status is None:
+                    continue
+                processes.remove(process)
+                if status != 0 and code == 0:
+                    code = status
+                    for other in processes:
+                        other.terminate()
+            if processes:
+                try:
+                    processes[0].wait(timeout=1)
+                except subprocess.TimeoutExpired:
+                    pass
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        raise
+    return code
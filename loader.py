@@ -1,34 +1,214 @@
-import os, cv2, numpy as np
+import os, csv, json, cv2, numpy as np
+import torch
+from torch.utils.data import default_collate
+
+def normalize(img, mask=None, memoryFormat=torch.contiguous_format):
+    # Turns a batch from a raw Loader (N x H x W x 3 and N x H x W uint8) into the float NCHW
+    # tensors the networks and losses expect, once per batch and on whatever device it lives on.
+    # The permuted batch already is channels_last, so that format costs no copy at all.
+    img = img.permute(0, 3, 1, 2).float().div_(255.0).contiguous(memory_format=memoryFormat)
+    if mask is None:
+        return img
+    mask = (mask >= 128).unsqueeze(1).float()
+    return img, mask
+
+def defaultWorkers():
+    # Leave one core to the main process, which runs the model and the optimizer
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    return min(8, cores - 1)
+
+def workerInit(worker_id):
+    # torch gives every worker its own seed but numpy's global RNG (used by augments/) is
+    # copied as-is into forked workers, which would otherwise all draw the same augmentations
+    np.random.seed(torch.initial_seed() % 2**32)
+
+def channelsLastCollate(batch):
+    # A channelsLast Loader returns HWC arrays; stacked as N x H x W x C and viewed as NCHW they
+    # are channels_last batches, without a transpose copy per sample or per batch
+    return [item.movedim(-1, -3) if torch.is_tensor(item) else item for item in default_collate(batch)]
+
+def loaderOptions(device, workers=None, prefetch=None, channelsLast=False):
+    # Keyword arguments for torch.utils.data.DataLoader feeding device; only copies to a GPU
+    # gain from pinned batches, a CPU run on a GPU host would pin every batch for nothing
+    workers = defaultWorkers() if workers is None else workers
+    options = dict(num_workers=workers, pin_memory=device.type == 'cuda')
+    if channelsLast:
+        options.update(collate_fn=channelsLastCollate)
+    if workers > 0:
+        options.update(persistent_workers=True, prefetch_factor=prefetch or 2, worker_init_fn=workerInit)
+    return options
+
+MANIFEST = 'manifest.csv'
+
+def listIds(root):
+    # Fallback for splits without a manifest; scans the whole directory
+    suffix = '_sat.jpg'
+    return sorted(entry.name[:-len(suffix)] for entry in os.scandir(root) if entry.name.endswith(suffix))
+
+def readManifest(root):
+    # Rows written by manifest.py, or None when the split has no manifest
+    path = os.path.join(root, MANIFEST)
+    if not os.path.isfile(path):
+        return None
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        for key in ('height', 'width', 'image_bytes', 'mask_bytes'):
+            row[key] = int(row[key])
+        row['road_fraction'] = float(row['road_fraction']) if row['road_fraction'] else None
+    return rows
+
+def decodeSplit(loader):
+    # Every tile of a split as uint8 arrays, N x H x W x 3 and N x H x W; a packed split is
+    # returned as its memory maps, anything else is decoded once into RAM
+    if loader.packed:
+        return loader.openPacked()
+    img, mask = loader.read(0)
+    images = np.empty((len(loader),) + img.shape, np.uint8)
+    masks = np.empty((len(loader),) + mask.shape, np.uint8)
+    for i in range(len(loader)):
+        images[i], masks[i] = loader.read(i) if i else (img, mask)
+    return images, masks
+
+class ValidCache:
+    '''
+    Serves the tiles `indices` of decoded arrays (see decodeSplit) in batches of uint8 tensors,
+    like a DataLoader over a raw Loader but without re-reading or re-decoding anything.
+    '''
+    def __init__(self, images, masks, batch, indices=None):
+        self.images = images
+        self.masks = masks
+        self.batch = batch
+        self.indices = np.arange(len(images)) if indices is None else np.sort(indices)
+
+    def __iter__(self):
+        for start in range(0, len(self.indices), self.batch):
+            chunk = self.indices[start:start+self.batch]
+            yield torch.from_numpy(self.images[chunk]), torch.from_numpy(self.masks[chunk])
+
+    def __len__(self):
+        return (len(self.indices) + self.batch - 1) // self.batch
 
 class Loader:
 
-    def __init__(self, root, test=False, augmentation=None):
+    def __init__(self, root, test=False, augmentation=None, packed=None, raw=False, patch=None, crops=1, roadBias=0.0, shards=None, channelsLast=False):
         self.test = test
         self.root = root
-        self.imagelist = list(filter(lambda x: x.find('sat')!=-1, os.listdir(root)))
-        self.trainlist = list(map(lambda x: x[:-8], self.imagelist))
+        self.packed = packed
+        self.shards = shards
+        self.variants = 1
+        self.manifest = None
+        if shards:
+            # Augmented variants written by materialize.py; index i of variant k is read as
+            # k * len(self) + i, see samplers.VariantSampler
+            with open(os.path.join(shards, 'meta.json')) as f:
+                self.variants = json.load(f)['variants']
+            with open(os.path.join(shards, 'ids.txt')) as f:
+                self.trainlist = f.read().split()
+        elif packed:
+            # Tiles pre-decoded by pack.py; see openPacked
+            with open(os.path.join(packed, 'ids.txt')) as f:
+                self.trainlist = f.read().split()
+        else:
+            self.manifest = readManifest(root)
+            self.trainlist = [row['id'] for row in self.manifest] if self.manifest else listIds(root)
+        self.images = None
+        self.masks = None
         self.augmentation = augmentation
+        self.raw = raw
+        # Float samples stay HWC, to be collated by channelsLastCollate
+        self.channelsLast = channelsLast
+        # Patch mode: every decoded tile yields `crops` random patch x patch crops
+        self.patch = patch
+        self.crops = crops
+        self.roadBias = roadBias
+
+    def __getstate__(self):
+        # Never pickle the memmaps into DataLoader workers, each worker maps the files itself
+        state = self.__dict__.copy()
+        state['images'] = None
+        state['masks'] = None
+        return state
+
+    def openPacked(self, variant=0):
+        if self.images is None:
+            self.images, self.masks = {}, {}
+        if variant not in self.images:
+            directory = os.path.join(self.shards, 'variant_{}'.format(variant)) if self.shards else self.packed
+            self.images[variant] = np.load(os.path.join(directory, 'images.npy'), mmap_mode='r')
+            self.masks[variant] = np.load(os.path.join(directory, 'masks.npy'), mmap_mode='r')
+        return self.images[variant], self.masks[variant]
+
+    def read(self, index):
+        if self.packed or self.shards:
+            variant, index = divmod(index, len(self.trainlist))
+            images, masks = self.openPacked(variant % self.variants)
+            return images[index], masks[index]
+        imgpath, maskpath = self.paths(index)
+        img = cv2.imread(imgpath)
+        mask = cv2.imread(maskpath, cv2.IMREAD_GRAYSCALE)
+        return img, mask
+
+    def paths(self, index):
+        if self.manifest:
+            row = self.manifest[index]
+            return os.path.join(self.root, row['image']), os.path.join(self.root, row['mask'])
+        id = self.trainlist[index]
+        return os.path.join(self.root, '{}_sat.jpg'.format(id)), os.path.join(self.root, '{}_mask.png'.format(id))
 
     def load(self, index):
-        index = self.trainlist[index]
-        img = cv2.imread(os.path.join(self.root, '{}_sat.jpg'.format(index)))
-        mask = cv2.imread(os.path.join(self.root, '{}_mask.png'.format(index)), cv2.IMREAD_GRAYSCALE)
+        img, mask = self.read(index)
+        if self.patch:
+            samples = [self.prepare(*crop) for crop in self.crop(img, mask)]
+            return np.stack([sample[0] for sample in samples]), np.stack([sample[1] for sample in samples])
+        return self.prepare(img, mask)
+
+    def crop(self, img, mask):
+        height, width = mask.shape
+        size = self.patch
+        if size > height or size > width:
+            raise ValueError('patch size {} exceeds the {}x{} tile'.format(size, height, width))
+        road = np.flatnonzero(mask >= 128) if self.roadBias else ()
+        for _ in range(self.crops):
+            if len(road) and np.random.random() < self.roadBias:
+                # Centre the crop on a random road pixel, shifted back inside the tile if needed
+                cy, cx = divmod(road[np.random.randint(len(road))], width)
+                top = min(max(cy - size // 2, 0), height - size)
+                left = min(max(cx - size // 2, 0), width - size)
+            else:
+                top = np.random.randint(height - size + 1)
+                left = np.random.randint(width - size + 1)
+            yield img[top:top+size, left:left+size], mask[top:top+size, left:left+size]
+
+    def prepare(self, img, mask):
         if self.augmentation:
             img, mask = self.augmentation(img, mask)
 
+        if self.raw:
+            # uint8 HWC, scaled and binarized per batch by normalize
+            return np.require(img, np.uint8, ['C', 'W']), np.require(mask, np.uint8, ['C', 'W'])
+
         mask = np.expand_dims(mask, axis=2)
-        img = np.array(img, np.float32).transpose(2,0,1)/255.0
-        mask = np.array(mask, np.float32).transpose(2,0,1)/255.0
+        if self.channelsLast:
+            img = np.array(img, np.float32)/255.0
+            mask = np.array(mask, np.float32)/255.0
+        else:
+            img = np.array(img, np.float32).transpose(2,0,1)/255.0
+            mask = np.array(mask, np.float32).transpose(2,0,1)/255.0
         mask[mask>=0.5] = 1
         mask[mask<=0.5] = 0
         return img, mask
 
     def tload(self, index):
-        index = self.trainlist[index]
-        path = os.path.join(self.root, '{}_sat.jpg'.format(index))
-        img = cv2.imread(path)
+        path = self.paths(index % len(self.trainlist))[0]
+        if self.packed or self.shards:
+            img = self.read(index)[0]
+        else:
+            img = cv2.imread(path)
 
-        img = np.array(img, np.float32).transpose(2,0,1)/255.0
+        if self.raw:
+            return os.path.basename(path.replace('sat.jpg', 'mask.png')), np.require(img, np.uint8, ['C', 'W'])
+        img = np.array(img, np.float32)/255.0 if self.channelsLast else np.array(img, np.float32).transpose(2,0,1)/255.0
         return os.path.basename(path.replace('sat.jpg', 'mask.png')), img
 
     def __len__(self):
@@ -0,0 +1,57 @@
+# Writes <split>/manifest.csv so loaders never have to list the split directory
+import os
+import sys
+import csv
+import cv2
+import argparse
+import numpy as np
+from datetime import datetime
+from pytz import timezone
+from loader import MANIFEST, listIds
+
+
+parser = argparse.ArgumentParser(description='manifest builder')
+
+parser.add_argument('-s',   '--stats',          type=int,   required=False, dest='stats',       help='print statistics')
+parser.add_argument('splits', type=str, nargs='+', help='split directories to index (e.g. train valid test)')
+
+FIELDS = ['id', 'image', 'mask', 'height', 'width', 'image_bytes', 'mask_bytes', 'road_fraction']
+
+def build(root, stats=500):
+    ids = listIds(root)
+    rows = []
+    for i, id in enumerate(ids):
+        image = '{}_sat.jpg'.format(id)
+        mask = '{}_mask.png'.format(id)
+        row = {'id': id, 'image': image, 'mask': mask,
+               'image_bytes': os.path.getsize(os.path.join(root, image)), 'mask_bytes': 0, 'road_fraction': ''}
+        if os.path.exists(os.path.join(root, mask)):
+            # Masks are decoded anyway for the road fraction and share the tile size with the image
+            label = cv2.imread(os.path.join(root, mask), cv2.IMREAD_GRAYSCALE)
+            row['height'], row['width'] = label.shape
+            row['mask_bytes'] = os.path.getsize(os.path.join(root, mask))
+            row['road_fraction'] = '{:.6f}'.format(np.count_nonzero(label >= 128) / label.size)
+        else:
+            row['mask'] = ''
+            row['height'], row['width'] = cv2.imread(os.path.join(root, image)).shape[:2]
+        rows.append(row)
+        if (i + 1) % stats == 0:
+            print('{}/{}\t{}'.format(i+1, len(ids), datetime.now(timezone("US/Pacific")).strftime("%m-%d-%Y - %I:%M %p")))
+
+    path = os.path.join(root, MANIFEST)
+    with open(path + '.tmp', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(path + '.tmp', path)
+    return rows
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    args.stats = 500 if not args.stats else args.stats
+
+    print('Manifest start')
+    print('Arguments -> {}'.format(' '.join(sys.argv)))
+    for split in args.splits:
+        rows = build(split, args.stats)
+        print('[+] indexed {} tiles in {}'.format(len(rows), os.path.join(split, MANIFEST)))
@@ -0,0 +1,61 @@
+# Pre-generates augmented variants of a split as packed uint8 shards read by loader.Loader
+import os
+import sys
+import json
+import argparse
+import importlib
+import numpy as np
+from pack import write
+
+
+parser = argparse.ArgumentParser(description='augmentation materializer')
+
+parser.add_argument('-n',   '--variants',       type=int,   required=True,  dest='variants',    help='augmented variants per tile')
+parser.add_argument('-sd',  '--seed',           type=int,   required=False, dest='seed',        help='base seed')
+parser.add_argument('-a',   '--augment',        type=str,   required=False, dest='augment',     help='module in augments/ providing augment(img, mask)')
+parser.add_argument('-pk',  '--packed',         type=str,   required=False, dest='packed',      help='read tiles from this pack.py directory instead of decoding them')
+parser.add_argument('-o',   '--output',         type=str,   required=False, dest='output',      help='directory to write shards to')
+parser.add_argument('-s',   '--stats',          type=int,   required=False, dest='stats',       help='print statistics')
+parser.add_argument('split', type=str, help='split directory to augment (e.g. train)')
+
+def sample(loader, augment, seed, index):
+    # Every stored sample is a pure function of its seed, so any of them can be regenerated
+    np.random.seed(seed)
+    img, mask = augment(*loader.read(index))
+    return np.ascontiguousarray(img), np.ascontiguousarray(mask)
+
+def seeds(seed, variants, tiles):
+    return seed + np.arange(variants * tiles, dtype=np.int64).reshape(variants, tiles)
+
+def materialize(root, dest, variants, seed=0, augment='dinkaugment', packed=None, stats=500):
+    from loader import Loader
+    loader = Loader(root, packed=packed)
+    function = getattr(importlib.import_module('augments.{}'.format(augment)), 'augment')
+    table = seeds(seed, variants, len(loader))
+
+    os.makedirs(dest, exist_ok=True)
+    for variant in range(variants):
+        print('[+] variant {}/{}'.format(variant + 1, variants))
+        write(os.path.join(dest, 'variant_{}'.format(variant)), loader.trainlist,
+              lambda i: sample(loader, function, int(table[variant, i]), i), stats)
+
+    np.save(os.path.join(dest, 'seeds.npy'), table)
+    with open(os.path.join(dest, 'ids.txt'), 'w') as f:
+        f.write('\n'.join(loader.trainlist) + '\n')
+    # Written last: a shard directory without meta.json is incomplete
+    with open(os.path.join(dest, 'meta.json'), 'w') as f:
+        json.dump({'split': root, 'variants': variants, 'tiles': len(loader), 'seed': seed, 'augment': augment}, f, indent=2)
+    return table
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    args.seed = 0 if args.seed is None else args.seed
+    args.augment = 'dinkaugment' if not args.augment else args.augment
+    args.output = 'shards' if not args.output else args.output
+    args.stats = 500 if not args.stats else args.stats
+
+    print('Materializing start')
+    print('Arguments -> {}'.format(' '.join(sys.argv)))
+    dest = os.path.join(args.output, os.path.basename(os.path.normpath(args.split)))
+    materialize(args.split, dest, args.variants, args.seed, args.augment, args.packed, args.stats)
+    print('[+] wrote {} variants of {} into {}'.format(args.variants, args.split, dest))
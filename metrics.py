@@ -0,0 +1,104 @@
+# Scores of a thresholded output image against its mask in labelDir, shared by valid.py,
+# quantize.py and prune.py
+import os
+import time
+import cv2
+import numpy as np
+import torch
+
+SMOOTH = 1e-6
+
+def iou(outputImage, filename, labelDir='test'):
+    labelFilePath = os.path.join(labelDir, filename.replace("_sat.jpg", "_mask.png")) # Gives us labelDir/id_mask.png ( True Mask )
+    labelImage = cv2.imread(labelFilePath, cv2.IMREAD_GRAYSCALE)/255.0 # Reads labelDir/true_mask.png as grey scale
+    outputImage = cv2.cvtColor(outputImage, cv2.COLOR_BGR2GRAY)/255.0 # Convert RGB Numpy Output To GreyScale
+    # Convert to Tensor
+    labelImage = torch.from_numpy(labelImage)
+    outputImage = torch.from_numpy(outputImage)
+    # Thresh hold
+    labelImage = labelImage >= 0.5
+    outputImage = outputImage >= 0.5
+    intersection = (labelImage & outputImage).int().sum().float().item()
+    union = (labelImage | outputImage).int().sum().float().item()
+    return (intersection + SMOOTH) / (union + SMOOTH)
+
+def f1(outputImage, filename, labelDir='test'):
+    labelFilePath = os.path.join(labelDir, filename.replace("_sat.jpg", "_mask.png")) # Gives us labelDir/id_mask.png ( True Mask )
+    labelImage = cv2.imread(labelFilePath, cv2.IMREAD_GRAYSCALE)/255.0 # Reads labelDir/true_mask.png as grey scale
+    outputImage = cv2.cvtColor(outputImage, cv2.COLOR_BGR2GRAY)/255.0 # Convert RGB Numpy Output To GreyScale
+    # Convert to Tensor
+    labelImage = torch.from_numpy(labelImage)
+    outputImage = torch.from_numpy(outputImage)
+    # Thresh hold
+    labelRoad = labelImage >= 0.5
+    outputRoad = outputImage >= 0.5
+
+    labelBackground = labelImage < 0.5
+    outputBackground = outputImage < 0.5
+
+    TP = (labelRoad & outputRoad).int().sum().float().item()
+    FP = (labelBackground & outputRoad).int().sum().float().item()
+    FN = (labelRoad & outputBackground).int().sum().float().item()
+    return (SMOOTH + 2 * TP) / (SMOOTH + 2 * TP + FN + FP)
+
+def recall(outputImage, filename, labelDir='test'):
+    labelFilePath = os.path.join(labelDir, filename.replace("_sat.jpg", "_mask.png")) # Gives us labelDir/id_mask.png ( True Mask )
+    labelImage = cv2.imread(labelFilePath, cv2.IMREAD_GRAYSCALE)/255.0 # Reads labelDir/true_mask.png as grey scale
+    outputImage = cv2.cvtColor(outputImage, cv2.COLOR_BGR2GRAY)/255.0 # Convert RGB Numpy Output To GreyScale
+    # Convert to Tensor
+    labelImage = torch.from_numpy(labelImage)
+    outputImage = torch.from_numpy(outputImage)
+    # Thresh hold
+    labelRoad = labelImage >= 0.5
+    outputRoad = outputImage >= 0.5
+
+    labelBackground = labelImage < 0.5
+    outputBackground = outputImage < 0.5
+
+    TP = (labelRoad & outputRoad).int().sum().float().item()
+    FP = (labelBackground & outputRoad).int().sum().float().item()
+    FN = (labelRoad & outputBackground).int().sum().float().item()
+    return (SMOOTH + TP) / (SMOOTH + TP + FN)
+
+def precision(outputImage, filename, labelDir='test'):
+    labelFilePath = os.path.join(labelDir, filename.replace("_sat.jpg", "_mask.png")) # Gives us labelDir/id_mask.png ( True Mask )
+    labelImage = cv2.imread(labelFilePath, cv2.IMREAD_GRAYSCALE)/255.0 # Reads labelDir/true_mask.png as grey scale
+    outputImage = cv2.cvtColor(outputImage, cv2.COLOR_BGR2GRAY)/255.0 # Convert RGB Numpy Output To GreyScale
+    # Convert to Tensor
+    labelImage = torch.from_numpy(labelImage)
+    outputImage = torch.from_numpy(outputImage)
+    # Thresh hold
+    labelRoad = labelImage >= 0.5
+    outputRoad = outputImage >= 0.5
+
+    labelBackground = labelImage < 0.5
+    outputBackground = outputImage < 0.5
+
+    TP = (labelRoad & outputRoad).int().sum().float().item()
+    FP = (labelBackground & outputRoad).int().sum().float().item()
+    FN = (labelRoad & outputBackground).int().sum().float().item()
+    return (SMOOTH + TP) / (SMOOTH + TP + FP)
+
+def sampleIds(root, count, seed=0):
+    # A fixed random sample of the tiles of a split, so before/after reports score the same tiles
+    from loader import listIds
+    ids = listIds(root)
+    return [ids[i] for i in np.sort(np.random.RandomState(seed).choice(len(ids), min(count, len(ids)), replace=False))]
+
+def evaluate(model, root, ids, device=torch.device('cpu'), memoryFormat=torch.channels_last):
+    # Mean IoU, F1, precision and recall of the plain tester over the tiles ids of root, and its
+    # mean seconds per tile; an eval-mode float network is fused in place by the tester
+    from testers.tester import tester
+    run = tester(model, batchsize=1, device=device, memoryFormat=memoryFormat)
+    totals = dict(iou=0.0, f1=0.0, precision=0.0, recall=0.0)
+    seconds = 0.0
+    with torch.inference_mode():
+        run(os.path.join(root, '{}_sat.jpg'.format(ids[0])))
+        for id in ids:
+            name = '{}_sat.jpg'.format(id)
+            start = time.perf_counter()
+            image = run(os.path.join(root, name))
+            seconds += time.perf_counter() - start
+            for metric, function in (('iou', iou), ('f1', f1), ('precision', precision), ('recall', recall)):
+                totals[metric] += function(image, name, root)
+    return {metric: value / len(ids) for metric, value in totals.items()}, seconds / len(ids)
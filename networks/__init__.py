@@ -0,0 +1,16 @@
+# Every network lives in networks/<Name>.py as class <Name>
+import os
+import importlib
+import torch
+
+
+def load(name):
+    # A network by name, or the path of a whole pickled network such as the pruned ones written
+    # by prune.py (unpickling needs this repository on the path, like the scripts have)
+    if os.path.isfile(name):
+        return torch.load(name, map_location='cpu', weights_only=False)
+    return getattr(importlib.import_module('networks.{}'.format(name)), name)()
+
+def label(name):
+    # What checkpoint names use for the network: its name, or the file name of a pickled one
+    return os.path.splitext(os.path.basename(name))[0] if os.path.isfile(name) else name
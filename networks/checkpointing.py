@@ -0,0 +1,89 @@
+'''
+Opt-in activation checkpointing for any network in networks/. Selected submodules are given a
+subclass of their own class whose forward runs under torch.utils.checkpoint while training, so
+parameters, state_dict keys and checkpoints stay exactly as they are.
+
+    stages  every top-level block of the network: the DenseBlocks, transitions and bottleneck of
+            the dense models, the ResNet34 layers, centre and decoder stages of the Unet34 family
+    blocks  the units inside those stages: every DenseLayer, every ResNet BasicBlock; stages
+            made of plain layers (conv_stage, upsample) are checkpointed whole
+
+stages keeps the fewest activations, blocks recomputes less per backward.
+'''
+import contextlib
+import torch
+import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+
+GRANULARITIES = ('blocks', 'stages')
+
+@contextlib.contextmanager
+def frozenStats(module):
+    # The recomputation in backward must not update BatchNorm running statistics a second time
+    norms = [m for m in module.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.track_running_stats]
+    saved = [(m.momentum, m.num_batches_tracked.clone()) for m in norms]
+    for m in norms:
+        m.momentum = 0.0
+    try:
+        yield
+    finally:
+        for m, (momentum, tracked) in zip(norms, saved):
+            m.momentum = momentum
+            m.num_batches_tracked.copy_(tracked)
+
+def run(function, module, *inputs):
+    calls = [0]
+    def segment(*inputs):
+        calls[0] += 1
+        if calls[0] == 1:
+            return function(*inputs)
+        with frozenStats(module):
+            return function(*inputs)
+    return checkpoint(segment, *inputs, use_reentrant=False)
+
+_classes = {}
+
+def checkpointed(cls):
+    if getattr(cls, 'checkpointed', False):
+        return cls
+    if cls not in _classes:
+        def forward(self, *inputs):
+            if not (self.training and torch.is_grad_enabled()):
+                return cls.forward(self, *inputs)
+            return run(lambda *inputs: cls.forward(self, *inputs), self, *inputs)
+        _classes[cls] = type('Checkpointed' + cls.__name__, (cls,), dict(forward=forward, checkpointed=True))
+    return _classes[cls]
+
+def units(module):
+    # Submodules that hold layers of their own, looking through ModuleLists
+    found = []
+    for child in module.children():
+        if isinstance(child, nn.ModuleList):
+            found += units(child)
+        elif next(child.children(), None) is not None and next(child.parameters(), None) is not None:
+            found.append(child)
+    return found
+
+def blocks(stage):
+    inner = units(stage)
+    if not inner:
+        return [stage]
+    if len(inner) == 1:
+        return blocks(inner[0])
+    return inner
+
+def targets(model, granularity):
+    if granularity not in GRANULARITIES:
+        raise ValueError('granularity must be one of {}, got {}'.format(GRANULARITIES, granularity))
+    stages = units(model)
+    if granularity == 'stages':
+        return stages
+    return [block for stage in stages for block in blocks(stage)]
+
+def enable(model, granularity='stages'):
+    # Returns the number of checkpointed segments; a DataParallel/DDP wrapper is looked through
+    model = getattr(model, 'module', model)
+    chosen = targets(model, granularity)
+    for module in chosen:
+        module.__class__ = checkpointed(type(module))
+    return len(chosen)
@@ -0,0 +1,91 @@
+'''
+Inference-time Conv + BatchNorm folding for any network in networks/. In eval mode a BatchNorm
+is a fixed per-channel affine map, so when it directly follows a convolution it is folded into
+that convolution's weight and bias and replaced by nn.Identity, saving one full pass over the
+activations per layer. Eligible are
+
+    Conv2d / ConvTranspose2d -> BatchNorm2d  adjacent in a plain nn.Sequential: conv_stage, the
+                                             d0..d4 branches, skipDilationPipeline, down0, ...
+    conv1 -> bn1, conv2 -> bn2 (-> bn3)      inside the torchvision ResNet blocks
+
+A Conv2d in a Sequential followed by a ReLU, right after it or after its folded BatchNorm, also
+absorbs the ReLU: one fused cuDNN call on CUDA, the convolution then an in-place ReLU elsewhere. The pre-activation
+BatchNorm -> ReLU -> Conv of the dense layers has no convolution in front and stays as it is.
+
+Folding works in place and leaves the model for inference only; call it on an eval-mode model.
+'''
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+from torchvision.models.resnet import BasicBlock, Bottleneck
+
+class ConvReLU(nn.Conv2d):
+    fused = True
+
+    def forward(self, x):
+        if x.is_cuda and x.dtype == self.weight.dtype and self.padding_mode == 'zeros' and not isinstance(self.padding, str):
+            return torch.cudnn_convolution_relu(x, self.weight, self.bias, self.stride, self.padding, self.dilation, self.groups)
+        return F.relu(super().forward(x), inplace=True)
+
+def fold(conv, bn):
+    folded = fuse_conv_bn_eval(conv, bn, transpose=isinstance(conv, nn.ConvTranspose2d))
+    # Keep the weight in the layout the model was converted to (see -cl / -tn)
+    if conv.weight.is_contiguous(memory_format=torch.channels_last) and not conv.weight.is_contiguous():
+        folded.weight.data = folded.weight.data.contiguous(memory_format=torch.channels_last)
+    return folded
+
+def chains(model):
+    # (conv, bn or None, relu or None) for every conv followed by a BatchNorm and/or a ReLU; the
+    # ReLU is only given inside a Sequential, where nothing else sees the convolution's output
+    for module in model.modules():
+        if type(module) is nn.Sequential:
+            children = list(module) + [None, None]
+            for i, conv in enumerate(children[:-2]):
+                if not isinstance(conv, (nn.Conv2d, nn.ConvTranspose2d)):
+                    continue
+                bn = children[i + 1] if isinstance(children[i + 1], nn.BatchNorm2d) else None
+                relu = children[i + 2 if bn is not None else i + 1]
+                relu = relu if isinstance(relu, nn.ReLU) else None
+                if bn is not None or relu is not None:
+                    yield conv, bn, relu
+        elif isinstance(module, (BasicBlock, Bottleneck)):
+            for i in (1, 2, 3):
+                if hasattr(module, 'conv{}'.format(i)):
+                    yield getattr(module, 'conv{}'.format(i)), getattr(module, 'bn{}'.format(i)), None
+
+def fuse(model):
+    '''
+    Folds every eligible BatchNorm of an eval-mode model into its convolution and fuses the
+    ReLUs after Conv2d layers, in place, and returns the number of folded BatchNorms. A
+    DataParallel or compiling.Compiled wrapper is looked through, as long as the compiled
+    network has not run yet.
+    '''
+    if model.training:
+        raise ValueError('fusing needs an eval-mode model')
+    # Modules registered under several names (firstconv is also down0[0]) are replaced
+    # everywhere, and never absorb a ReLU, since they may also be called on their own
+    registrations = {}
+    for module in model.modules():
+        for name, child in module._modules.items():
+            if child is not None:
+                registrations.setdefault(id(child), []).append((module, name))
+    replaced = {}
+    count = 0
+    for conv, bn, relu in list(chains(model)):
+        if id(conv) in replaced or (bn is not None and not bn.track_running_stats):
+            continue
+        aliased = len(registrations[id(conv)]) > 1
+        if bn is not None:
+            replaced[id(bn)] = nn.Identity()
+            folded = fold(conv, bn)
+            replaced[id(conv)] = folded
+            conv = folded
+            count += 1
+        if relu is not None and type(conv) is nn.Conv2d and not aliased and len(registrations[id(relu)]) == 1:
+            conv.__class__ = ConvReLU
+            replaced[id(relu)] = nn.Identity()
+    for key, module in replaced.items():
+        for parent, name in registrations[key]:
+            parent._modules[name] = module
+    return count
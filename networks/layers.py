@@ -15,10 +15,80 @@ class DenseLayer(nn.Sequential):
         return super().forward(x)
 
 
+def fillShared(x, layers):
+    # Runs the dense layers into one preallocated N x (C + L*growth) x H x W buffer: layer i reads
+    # the first channels of the buffer as a view and writes its output right after them, which
+    # is what torch.cat([x, out], 1) computes, without reallocating and copying per layer
+    channels = x.size(1)
+    buffer = None
+    for layer in layers:
+        out = layer(x if buffer is None else buffer[:, :channels])
+        if buffer is None:
+            growth = out.size(1)
+            memory = torch.channels_last if x.dim() == 4 and not x.is_contiguous() and x.is_contiguous(memory_format=torch.channels_last) else torch.contiguous_format
+            buffer = torch.empty((x.size(0), channels + growth * len(layers)) + x.shape[2:], dtype=torch.promote_types(x.dtype, out.dtype),
+                                 device=x.device, memory_format=memory)
+            buffer[:, :channels] = x
+        buffer[:, channels:channels + out.size(1)] = out
+        channels += out.size(1)
+    return buffer, out.dtype
+
+
+class SharedDenseFunction(torch.autograd.Function):
+    '''
+    Memory-efficient DenseBlock (Pleiss et al., 2017). Forward keeps only the shared feature
+    buffer; backward walks the layers in reverse, recomputes the cheap BatchNorm + ReLU of each
+    layer from its view of the buffer and applies the convolution gradients directly, so neither
+    the concatenations nor the BN-ReLU outputs are ever stored.
+    '''
+    @staticmethod
+    def forward(ctx, x, block, *params):
+        with torch.no_grad():
+            buffer, convDtype = fillShared(x, block.layers)
+        ctx.block = block
+        ctx.channels = x.size(1)
+        ctx.convDtype = convDtype
+        ctx.device = x.device.type
+        ctx.autocast = torch.is_autocast_enabled(ctx.device)
+        ctx.autocastDtype = torch.get_autocast_dtype(ctx.device)
+        ctx.save_for_backward(buffer)
+        return buffer
+
+    @staticmethod
+    def backward(ctx, grad):
+        from .checkpointing import frozenStats
+        buffer, = ctx.saved_tensors
+        grad = grad.clone(memory_format=torch.contiguous_format)
+        layers = ctx.block.layers
+        grads = []
+        channels = ctx.channels + sum(layer.conv.out_channels for layer in layers)
+        for layer in reversed(layers):
+            conv = layer.conv
+            channels -= conv.out_channels
+            features = buffer[:, :channels].detach().requires_grad_()
+            gradOut = grad[:, channels:channels + conv.out_channels].to(ctx.convDtype)
+            with torch.enable_grad(), frozenStats(layer), torch.autocast(ctx.device, ctx.autocastDtype, enabled=ctx.autocast):
+                activated = layer.relu(layer.norm(features))
+            inputs = activated.detach().to(ctx.convDtype)
+            weight = conv.weight.to(ctx.convDtype)
+            gradActivated = nn.grad.conv2d_input(inputs.shape, weight, gradOut, conv.stride, conv.padding, conv.dilation, conv.groups)
+            gradWeight = nn.grad.conv2d_weight(inputs, conv.weight.shape, gradOut, conv.stride, conv.padding, conv.dilation, conv.groups)
+            gradBias = gradOut.sum((0, 2, 3)) if conv.bias is not None else None
+            gradFeatures, gradNormWeight, gradNormBias = torch.autograd.grad(
+                activated, (features, layer.norm.weight, layer.norm.bias), gradActivated.to(activated.dtype))
+            grad[:, :channels] += gradFeatures
+            grads.append([gradNormWeight, gradNormBias, gradWeight.to(conv.weight.dtype),
+                          gradBias.to(conv.bias.dtype) if gradBias is not None else None])
+        flat = [g for layerGrads in reversed(grads) for g in layerGrads]
+        return (grad[:, :ctx.channels], None) + tuple(flat)
+
+
 class DenseBlock(nn.Module):
     def __init__(self, in_channels, growth_rate, n_layers, upsample=False, dropout_rate = None):
         super().__init__()
         self.upsample = upsample
+        # See memoryEfficient; off by default, weights are the same either way
+        self.efficient = False
         self.layers = nn.ModuleList([DenseLayer(
             in_channels + i*growth_rate, growth_rate)
             for i in range(n_layers)])
@@ -26,7 +96,16 @@ class DenseBlock(nn.Module):
         if dropout_rate:
             self.dropout = nn.Dropout2d(dropout_rate)
 
+    def sharedParameters(self):
+        return [p for layer in self.layers for p in (layer.norm.weight, layer.norm.bias, layer.conv.weight, layer.conv.bias)]
+
     def forward(self, x):
+        if self.efficient and self.dropout is None:
+            if self.training and torch.is_grad_enabled():
+                out = SharedDenseFunction.apply(x, self, *self.sharedParameters())
+            else:
+                out = fillShared(x, self.layers)[0]
+            return out[:, x.size(1):] if self.upsample else out
         if self.upsample:
             new_features = []
             #we pass all previous activations into each dense layer normally
@@ -48,6 +127,14 @@ class DenseBlock(nn.Module):
             return x
 
 
+def memoryEfficient(model, enabled=True):
+    # Switches every DenseBlock of a model to the shared-buffer implementation above
+    blocks = [m for m in getattr(model, 'module', model).modules() if isinstance(m, DenseBlock)]
+    for block in blocks:
+        block.efficient = enabled
+    return len(blocks)
+
+
 class TransitionDown(nn.Sequential):
     def __init__(self, in_channels,pool_size=2,n_maxpools=1):
         super().__init__()
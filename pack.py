@@ -0,0 +1,61 @@
+# Decodes a dataset split once into memory-mapped uint8 arrays read by loader.Loader
+import os
+import sys
+import argparse
+import numpy as np
+from datetime import datetime
+from pytz import timezone
+
+
+parser = argparse.ArgumentParser(description='packer')
+
+parser.add_argument('-o',   '--output',         type=str,   required=False, dest='output',      help='directory to write packed splits to')
+parser.add_argument('-s',   '--stats',          type=int,   required=False, dest='stats',       help='print statistics')
+parser.add_argument('splits', type=str, nargs='+', help='split directories to pack (e.g. train valid)')
+
+def write(dest, ids, read, stats=500):
+    # Stores read(i) -> (image, mask) for every id as uint8 memmaps in dest
+    os.makedirs(dest, exist_ok=True)
+    height, width = read(0)[0].shape[:2]
+    images = np.lib.format.open_memmap(os.path.join(dest, 'images.npy.tmp'), mode='w+',
+                                       dtype=np.uint8, shape=(len(ids), height, width, 3))
+    masks = np.lib.format.open_memmap(os.path.join(dest, 'masks.npy.tmp'), mode='w+',
+                                      dtype=np.uint8, shape=(len(ids), height, width))
+
+    for i, id in enumerate(ids):
+        img, mask = read(i)
+        if img.shape[:2] != (height, width) or mask is None or mask.shape != (height, width):
+            raise ValueError('tile {} for {} does not match the {}x{} tile size'.format(id, dest, height, width))
+        images[i] = img
+        masks[i] = mask
+        if (i + 1) % stats == 0:
+            print('{}/{}\t{}'.format(i+1, len(ids), datetime.now(timezone("US/Pacific")).strftime("%m-%d-%Y - %I:%M %p")))
+
+    images.flush()
+    masks.flush()
+    del images, masks
+    # Rename last so an interrupted pack never leaves a half-written split behind
+    os.replace(os.path.join(dest, 'images.npy.tmp'), os.path.join(dest, 'images.npy'))
+    os.replace(os.path.join(dest, 'masks.npy.tmp'), os.path.join(dest, 'masks.npy'))
+    with open(os.path.join(dest, 'ids.txt'), 'w') as f:
+        f.write('\n'.join(ids) + '\n')
+    return len(ids)
+
+def pack(root, dest, stats=500):
+    from loader import Loader
+    loader = Loader(root)
+    if not loader.trainlist:
+        raise ValueError('no *_sat.jpg tiles found in {}'.format(root))
+    return write(dest, loader.trainlist, loader.read, stats)
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    args.output = 'packed' if not args.output else args.output
+    args.stats = 500 if not args.stats else args.stats
+
+    print('Packing start')
+    print('Arguments -> {}'.format(' '.join(sys.argv)))
+    for split in args.splits:
+        dest = os.path.join(args.output, os.path.basename(os.path.normpath(split)))
+        count = pack(split, dest, args.stats)
+        print('[+] packed {} tiles from {} into {}'.format(count, split, dest))
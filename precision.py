@@ -0,0 +1,40 @@
+# Mixed-precision helpers for the training loop: autocast contexts, gradient scaling and
+# an autocast-safe final sigmoid for networks that end in nn.Sigmoid
+import contextlib
+import torch
+import torch.nn as nn
+
+PRECISIONS = ('fp32', 'fp16', 'bf16')
+DTYPES = {'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+class Float32Sigmoid(nn.Sigmoid):
+    # Sigmoid on float32 logits: in half precision probabilities saturate to exactly 0 or 1,
+    # which BCELoss clamps to log(0) = -100 and SSIM divides through
+    def forward(self, x):
+        with torch.autocast(device_type=x.device.type, enabled=False):
+            return torch.sigmoid(x.float())
+
+def autocastSafe(model):
+    # Swaps every nn.Sigmoid for Float32Sigmoid in place; there are no parameters or buffers
+    # involved, so state dicts stay interchangeable with float32 models
+    for module in model.modules():
+        if type(module) is nn.Sigmoid:
+            module.__class__ = Float32Sigmoid
+    return model
+
+def autocast(device, precision):
+    if precision == 'fp32':
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=torch.device(device).type, dtype=DTYPES[precision])
+
+def gradScaler(device, precision):
+    # Only float16 needs loss scaling, bfloat16 has float32's exponent range
+    enabled = precision == 'fp16'
+    if hasattr(torch, 'amp') and hasattr(torch.amp, 'GradScaler'):
+        return torch.amp.GradScaler(torch.device(device).type, enabled=enabled)
+    return torch.cuda.amp.GradScaler(enabled=enabled)
+
+def criterionFloat32(criterion, outputs, labels):
+    # The losses (BCELoss, SSIM, dice, lovasz) are not autocast-safe, run them in float32
+    with torch.autocast(device_type=outputs.device.type, enabled=False):
+        return criterion(outputs.float(), labels.float())
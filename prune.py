@@ -0,0 +1,210 @@
+# Structured channel pruning of the decoder of the Unet34 family (TransposeUnet34, BilinearUnet34,
+# DBilinearUnet34, ...). Every Unet34 runs conv_stage(512, 1024) at 1/64 of the tile and the
+# largest weights of the decoder around it; the low-ranked channels of the center, up* and trans*
+# stages are removed physically, so the pruned network is an ordinary, smaller network.
+#
+# Channels followed by a BatchNorm are ranked by |gamma|, the outputs of the trans* stages (no
+# BatchNorm) by the L1 norm of their filters. The pruned network is pickled whole, in train mode,
+# and loads wherever a network name is accepted (train.py, valid.py, test.py, quantize.py); with
+# -ft it is fine-tuned through train.py and the best validation checkpoint is pickled in its place.
+# Parameters, convolution FLOPs, latency and IoU are reported before and after.
+import os
+import sys
+import copy
+import shlex
+import argparse
+import subprocess
+import torch
+import torch.nn as nn
+import networks
+from checkpoints import readIndex
+from devices import resolve, loadState
+from metrics import sampleIds, evaluate
+
+STAGES = ('center',) + tuple('up{}'.format(i) for i in range(5)) + tuple('trans{}'.format(i) for i in range(5))
+
+
+parser = argparse.ArgumentParser(description='decoder channel pruning')
+
+parser.add_argument('-wt',  '--weights',        type=str,   required=True,  dest='weights',     help='weights file in weights/')
+parser.add_argument('-pr',  '--ratio',          type=float, required=False, dest='ratio',       help='share of the channels removed from every pruned layer (default 0.5)')
+parser.add_argument('-st',  '--stages',         type=str,   nargs='+',      dest='stages',      choices=STAGES, help='stages to prune (default: center, up0-4 and trans0-4)')
+parser.add_argument('-mc',  '--min-channels',   type=int,   required=False, dest='minChannels', help='channels always kept per layer (default 8)')
+parser.add_argument('-o',   '--output',         type=str,   required=False, dest='output',      help='pickled network to write (default: weights/<weights>_pruned.pth)')
+parser.add_argument('-ft',  '--finetune',       type=int,   required=False, dest='finetune',    help='fine-tune this many epochs through train.py before exporting')
+parser.add_argument('-lr',  '--learning_rate',  type=float, required=False, dest='lr',          help='fine-tune learning rate (default 1e-4)')
+parser.add_argument('-b',   '--batch',          type=int,   required=False, dest='batch',       help='fine-tune batch size (default 8)')
+parser.add_argument('-ls',  '--loss',           type=str,   required=False, dest='loss',        help='fine-tune loss (default: that of train.py)')
+parser.add_argument('-ta',  '--train-args',     type=str,   required=False, dest='trainArgs',   help='further train.py arguments for the fine-tune, as one string')
+parser.add_argument('-dr',  '--data-root',      type=str,   required=False, dest='data',        help='directory holding the train/, valid/ and test/ splits (default: .)')
+parser.add_argument('-ev',  '--evaluate',       type=int,   required=False, dest='evaluate',    help='test/ tiles to score before and after, 0 to skip (default 32)')
+parser.add_argument('-sz',  '--size',           type=int,   required=False, dest='size',        help='tile size FLOPs are counted at (default 1024)')
+parser.add_argument('-d',   '--device',         type=str,   required=False, dest='device',      help='cpu or cuda:N for the reports (default cuda when available)')
+parser.add_argument('model', type=str, help='name of model')
+
+def outputWeight(conv):
+    # Weight with output channels first, for Conv2d ([out, in, kh, kw]) and ConvTranspose2d ([in, out, kh, kw])
+    return conv.weight.transpose(0, 1) if isinstance(conv, nn.ConvTranspose2d) else conv.weight
+
+def keepOutputs(conv, keep):
+    pruned = copy.deepcopy(conv)
+    dim = 1 if isinstance(conv, nn.ConvTranspose2d) else 0
+    pruned.weight = nn.Parameter(conv.weight.data.index_select(dim, keep).clone())
+    if conv.bias is not None:
+        pruned.bias = nn.Parameter(conv.bias.data[keep].clone())
+    pruned.out_channels = len(keep)
+    return pruned
+
+def keepInputs(conv, keep):
+    pruned = copy.deepcopy(conv)
+    dim = 0 if isinstance(conv, nn.ConvTranspose2d) else 1
+    pruned.weight = nn.Parameter(conv.weight.data.index_select(dim, keep).clone())
+    pruned.in_channels = len(keep)
+    return pruned
+
+def keepNorm(norm, keep):
+    pruned = copy.deepcopy(norm)
+    pruned.weight = nn.Parameter(norm.weight.data[keep].clone())
+    pruned.bias = nn.Parameter(norm.bias.data[keep].clone())
+    pruned.running_mean = norm.running_mean[keep].clone()
+    pruned.running_var = norm.running_var[keep].clone()
+    pruned.num_features = len(keep)
+    return pruned
+
+def groups(model, stages):
+    '''
+    The prunable channel groups of a Unet34 decoder as (name, producer, norm, consumer, offset):
+    channels produced by producer = (Sequential, index), normalized by the norm index of the same
+    Sequential or None, and read by consumer = (Sequential, index) at input offset onwards. The
+    trans* outputs come first in the torch.cat that feeds the up* stage, so their offset is 0.
+    '''
+    found = []
+    for stage in stages:
+        if stage == 'center' or stage.startswith('up'):
+            block = getattr(model, stage)
+            level = 5 if stage == 'center' else int(stage[2:])
+            # What reads the stage: the next trans* stage, after up0 the final upsampling
+            after = (getattr(model, 'trans{}'.format(level - 1)), 0) if level > 0 else (model.finalup, 0)
+            found.append((stage + '.inner', (block, 0), 1, (block, 3), 0))
+            found.append((stage + '.out', (block, 3), 4, after, 0))
+        else:
+            level = int(stage[5:])
+            found.append((stage, (getattr(model, stage), 0), None, (getattr(model, 'up{}'.format(level)), 0), 0))
+    return found
+
+def check(model):
+    for stage in STAGES:
+        block = getattr(model, stage, None)
+        if not isinstance(block, nn.Sequential):
+            raise ValueError('{} has no Unet34 decoder: {} is missing'.format(type(model).__name__, stage))
+        if stage == 'center' or stage.startswith('up'):
+            kinds = [type(block[i]) for i in (0, 1, 3, 4)]
+            if kinds != [nn.Conv2d, nn.BatchNorm2d, nn.Conv2d, nn.BatchNorm2d]:
+                raise ValueError('{} is not a conv_stage with BatchNorm'.format(stage))
+
+def prune(model, stages=STAGES, ratio=0.5, minChannels=8):
+    # In place; returns {group: (channels before, channels after)}
+    check(model)
+    pruned = {}
+    for name, (block, index), norm, (reader, at), offset in groups(model, stages):
+        conv = block[index]
+        channels = outputWeight(conv).size(0)
+        kept = min(channels, max(minChannels, channels - int(round(channels * ratio))))
+        if kept == channels:
+            continue
+        with torch.no_grad():
+            scores = block[norm].weight.abs() if norm is not None else outputWeight(conv).abs().flatten(1).sum(1)
+        keep = scores.topk(kept).indices.sort().values
+        block[index] = keepOutputs(conv, keep)
+        if norm is not None:
+            block[norm] = keepNorm(block[norm], keep)
+        # The reader keeps every input outside this group
+        inputs = outputWeight(reader[at]).size(1)
+        rest = torch.cat([torch.arange(offset), torch.arange(offset + channels, inputs)])
+        reader[at] = keepInputs(reader[at], torch.cat([keep + offset, rest]).sort().values)
+        pruned[name] = (channels, kept)
+    return pruned
+
+def convFlops(model, size, device):
+    # Multiply-adds of every convolution (2 FLOPs each) for one size x size tile
+    total = [0]
+    def count(module, inputs, output):
+        if isinstance(module, nn.ConvTranspose2d):
+            total[0] += inputs[0].numel() * module.weight[0].numel() // module.groups
+        else:
+            total[0] += output.numel() * module.weight[0].numel()
+    hooks = [m.register_forward_hook(count) for m in model.modules() if isinstance(m, (nn.Conv2d, nn.ConvTranspose2d))]
+    try:
+        with torch.inference_mode():
+            model(torch.zeros(1, 3, size, size, device=device))
+    finally:
+        for hook in hooks:
+            hook.remove()
+    return 2 * total[0]
+
+def report(model, args, device, ids):
+    model = copy.deepcopy(model).to(device).eval()
+    row = dict(parameters=sum(p.numel() for p in model.parameters()), gflops=convFlops(model, args.size, device) / 1e9)
+    if ids:
+        memoryFormat = torch.channels_last if device.type == 'cpu' else torch.contiguous_format
+        metrics, seconds = evaluate(model.to(memory_format=memoryFormat), os.path.join(args.data, 'test'), ids, device, memoryFormat)
+        row.update(metrics, ms=seconds * 1000)
+    return row
+
+def finetune(path, args):
+    # train.py names its checkpoints after the pickled file; the best validation loss is kept
+    command = [sys.executable, 'train.py', '-lr', str(args.lr), '-b', str(args.batch), '-it', str(args.finetune), '-dr', args.data]
+    command += (['-ls', args.loss] if args.loss else []) + (['-d', args.device] if args.device else [])
+    command += shlex.split(args.trainArgs or '') + [path]
+    print('[+] fine-tuning -> {}'.format(' '.join(command)))
+    subprocess.run(command, check=True)
+    prefix = 'val_loss_{}_'.format(networks.label(path))
+    entries = [record['entries'][0] for metric, record in readIndex().items() if metric.startswith(prefix) and record['entries']]
+    if not entries:
+        raise RuntimeError('the fine-tune saved no {}* checkpoint'.format(prefix))
+    return min(entries, key=lambda entry: entry['value'])['file']
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    args.ratio = 0.5 if args.ratio is None else args.ratio
+    args.stages = args.stages or list(STAGES)
+    args.minChannels = args.minChannels or 8
+    args.output = args.output or os.path.join('weights', '{}_pruned.pth'.format(os.path.splitext(args.weights)[0]))
+    args.lr = args.lr or 1e-4
+    args.batch = args.batch or 8
+    args.data = args.data or '.'
+    args.evaluate = 32 if args.evaluate is None else args.evaluate
+    args.size = args.size or 1024
+    if not 0 <= args.ratio < 1:
+        parser.error('-pr must be in [0, 1)')
+
+    print('Pruning start')
+    print('Arguments -> {}'.format(' '.join(sys.argv)))
+    device = resolve(args.device)
+    ids = sampleIds(os.path.join(args.data, 'test'), args.evaluate) if args.evaluate else []
+
+    model = networks.load(args.model)
+    try:
+        check(model)
+    except ValueError as e:
+        parser.error(str(e))
+    loadState(model, torch.load(os.path.join('weights', args.weights), map_location='cpu'))
+    before = report(model, args, device, ids)
+
+    changes = prune(model, args.stages, args.ratio, args.minChannels)
+    for name, (channels, kept) in changes.items():
+        print('[=] {:<12} {:>5} -> {:>5} channels'.format(name, channels, kept))
+    torch.save(model, args.output)
+    print('[+] wrote {}'.format(args.output))
+
+    if args.finetune:
+        best = finetune(args.output, args)
+        loadState(model, torch.load(best, map_location='cpu'))
+        torch.save(model, args.output)
+        print('[+] wrote {} with the weights of {}'.format(args.output, best))
+
+    after = report(model, args, device, ids)
+    columns = ['parameters', 'gflops'] + (['iou', 'f1', 'precision', 'recall', 'ms'] if ids else [])
+    print('{:<8}'.format('') + ''.join('{:>12}'.format(column) for column in columns))
+    for name, row in (('before', before), ('after', after)):
+        print('{:<8}'.format(name) + ''.join('{:>12}'.format('{:,}'.format(row[c]) if c == 'parameters' else '{:.4g}'.format(row[c])) for c in columns))
@@ -0,0 +1,97 @@
+# Post-training static int8 quantization (FX graph mode) of a trained network for CPU inference.
+# Calibrates on a fixed sample of train/ tiles, writes the quantized network as TorchScript (loaded
+# by valid.py and test.py with -qt) and reports IoU, F1, precision, recall and latency of the float
+# and the int8 network on test/ tiles with the metrics of valid.py (metrics.evaluate).
+import os
+import sys
+import copy
+import time
+import argparse
+import numpy as np
+import torch
+import networks
+from loader import Loader
+from metrics import sampleIds, evaluate
+from devices import configureCpu, loadState
+
+BACKENDS = ('x86', 'fbgemm', 'onednn', 'qnnpack')
+
+
+parser = argparse.ArgumentParser(description='int8 quantizer')
+
+parser.add_argument('-wt',  '--weights',        type=str,   required=True,  dest='weights',     help='weights file in weights/')
+parser.add_argument('-o',   '--output',         type=str,   required=False, dest='output',      help='TorchScript file to write (default: weights/<weights>_int8.pt)')
+parser.add_argument('-dr',  '--data-root',      type=str,   required=False, dest='data',        help='directory holding the train/ and test/ splits (default: .)')
+parser.add_argument('-cs',  '--calibration',    type=int,   required=False, dest='calibration', help='train/ tiles to calibrate on (default 32)')
+parser.add_argument('-cb',  '--calibration-batch', type=int, required=False, dest='batch',      help='tiles per calibration forward (default 4)')
+parser.add_argument('-ev',  '--evaluate',       type=int,   required=False, dest='evaluate',    help='test/ tiles to score both networks on, 0 to skip (default 32)')
+parser.add_argument('-bk',  '--backend',        type=str,   required=False, dest='backend',     choices=BACKENDS, help='quantized engine (default x86, else the first supported)')
+parser.add_argument('-tt',  '--threads',        type=int,   required=False, dest='threads',     help='intra-op CPU threads (default: all cores)')
+parser.add_argument('model', type=str, help='name of model, or path of a pickled network (see prune.py)')
+
+def defaultBackend():
+    supported = torch.backends.quantized.supported_engines
+    return next(backend for backend in BACKENDS if backend in supported)
+
+def loadQuantized(path):
+    # The engine the network was quantized for is stored next to it and selected again here
+    extra = {'backend': ''}
+    model = torch.jit.load(path, map_location='cpu', _extra_files=extra)
+    backend = extra['backend'].decode() if isinstance(extra['backend'], bytes) else extra['backend']
+    torch.backends.quantized.engine = backend or defaultBackend()
+    return model.eval()
+
+def calibrationBatches(root, count, batch, seed=0):
+    # A fixed random sample of tiles, as float NCHW channels_last batches
+    loader = Loader(root)
+    ids = np.sort(np.random.RandomState(seed).choice(len(loader), min(count, len(loader)), replace=False))
+    for start in range(0, len(ids), batch):
+        images = np.stack([loader.load(i)[0] for i in ids[start:start+batch]])
+        yield torch.from_numpy(images).contiguous(memory_format=torch.channels_last)
+
+def quantize(model, batches, backend):
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+    torch.backends.quantized.engine = backend
+    batches = iter(batches)
+    first = next(batches)
+    # prepare_fx fuses Conv + BatchNorm + ReLU itself and places the observers
+    prepared = prepare_fx(model, get_default_qconfig_mapping(backend), (first,))
+    with torch.inference_mode():
+        for images in [first] + list(batches):
+            prepared(images)
+    return convert_fx(prepared), first
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    args.data = args.data or '.'
+    args.calibration = args.calibration or 32
+    args.batch = args.batch or 4
+    args.evaluate = 32 if args.evaluate is None else args.evaluate
+    args.backend = args.backend or defaultBackend()
+    args.output = args.output or os.path.join('weights', '{}_int8.pt'.format(os.path.splitext(args.weights)[0]))
+
+    print('Quantization start')
+    print('Arguments -> {}'.format(' '.join(sys.argv)))
+    configureCpu(args.threads)
+
+    model = networks.load(args.model)
+    loadState(model, torch.load(os.path.join('weights', args.weights), map_location='cpu'))
+    model = model.to(memory_format=torch.channels_last).eval()
+
+    start = time.perf_counter()
+    quantized, example = quantize(copy.deepcopy(model), calibrationBatches(os.path.join(args.data, 'train'), args.calibration, args.batch), args.backend)
+    print('[+] calibrated on {} tiles in {:.1f}s ({})'.format(args.calibration, time.perf_counter() - start, args.backend))
+    with torch.inference_mode():
+        scripted = torch.jit.freeze(torch.jit.trace(quantized, example[:1]))
+    torch.jit.save(scripted, args.output, _extra_files={'backend': args.backend})
+    print('[+] wrote {}'.format(args.output))
+
+    if args.evaluate:
+        root = os.path.join(args.data, 'test')
+        ids = sampleIds(root, args.evaluate)
+        print('{:<8} {:>8} {:>8} {:>10} {:>8} {:>10}'.format('model', 'IoU', 'F1', 'precision', 'recall', 'ms/tile'))
+        for name, network in (('float32', model), ('int8', loadQuantized(args.output))):
+            metrics, seconds = evaluate(network, root, ids)
+            print('{:<8} {:>8.5f} {:>8.5f} {:>10.5f} {:>8.5f} {:>10.1f}'.format(
+                name, metrics['iou'], metrics['f1'], metrics['precision'], metrics['recall'], seconds * 1000))
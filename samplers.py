@@ -0,0 +1,121 @@
+import itertools
+import torch
+import torch.utils.data as data
+from loader import readManifest
+
+
+def roadFractions(loader):
+    # Per-tile road-pixel fractions in the order of loader.trainlist, taken from the split's
+    # manifest.csv; the manifest is built (and so cached) the first time it is missing
+    rows = loader.manifest or readManifest(loader.root)
+    if rows is None:
+        from manifest import build
+        build(loader.root)
+        rows = readManifest(loader.root)
+    fractions = {row['id']: row['road_fraction'] for row in rows}
+    return [fractions[id] for id in loader.trainlist]
+
+
+class RoadDensitySampler(data.Sampler):
+    '''
+    Draws tiles with probability proportional to (road_fraction + floor) ** (1 / temperature).
+    temperature=1 samples proportionally to road density, larger values approach uniform sampling.
+    emptyCap bounds the share of tiles without any road pixel in each epoch.
+    '''
+    def __init__(self, fractions, temperature=1.0, emptyCap=None, floor=1e-3, numSamples=None, seed=0):
+        if temperature <= 0:
+            raise ValueError('temperature must be positive, got {}'.format(temperature))
+        fractions = torch.tensor(fractions, dtype=torch.float64)
+        self.weights = (fractions + floor) ** (1.0 / temperature)
+        self.empty = fractions <= 0
+        self.emptyCap = emptyCap
+        self.numSamples = len(fractions) if numSamples is None else numSamples
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        indices = torch.multinomial(self.weights, self.numSamples, replacement=True, generator=generator)
+        if self.emptyCap is not None and not self.empty.all():
+            drawn = self.empty[indices].nonzero().flatten()
+            excess = len(drawn) - int(self.emptyCap * self.numSamples)
+            if excess > 0:
+                # Redraw the surplus empty tiles from the tiles that do contain road
+                replace = drawn[torch.randperm(len(drawn), generator=generator)[:excess]]
+                weights = self.weights.masked_fill(self.empty, 0)
+                indices[replace] = torch.multinomial(weights, excess, replacement=True, generator=generator)
+        return iter(indices.tolist())
+
+    def __len__(self):
+        return self.numSamples
+
+
+class VariantSampler(data.Sampler):
+    '''
+    Wraps a sampler over the tiles of a materialize.py shard directory so that epoch k reads
+    variant k mod variants: tile i is yielded as (k mod variants) * tiles + i.
+    '''
+    def __init__(self, sampler, tiles, variants):
+        self.sampler = sampler
+        self.tiles = tiles
+        self.variants = variants
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        if hasattr(self.sampler, 'set_epoch'):
+            self.sampler.set_epoch(epoch)
+
+    def __iter__(self):
+        offset = (self.epoch % self.variants) * self.tiles
+        return (offset + index for index in self.sampler)
+
+    def __len__(self):
+        return len(self.sampler)
+
+
+class ShuffleSampler(data.Sampler):
+    '''
+    Uniform shuffling like RandomSampler, but the permutation of every epoch is drawn from
+    seed + epoch so an interrupted epoch can be replayed in the same order.
+    '''
+    def __init__(self, size, seed=0):
+        self.size = size
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        return iter(torch.randperm(self.size, generator=generator).tolist())
+
+    def __len__(self):
+        return self.size
+
+
+class SkipSampler(data.Sampler):
+    '''
+    Drops the first `skip` indices of the next epoch of a deterministic sampler, to resume that
+    epoch where it stopped. Later epochs are passed through whole.
+    '''
+    def __init__(self, sampler, skip=0):
+        self.sampler = sampler
+        self.skip = skip
+
+    def set_epoch(self, epoch):
+        if hasattr(self.sampler, 'set_epoch'):
+            self.sampler.set_epoch(epoch)
+
+    def __iter__(self):
+        skip, self.skip = self.skip, 0
+        return itertools.islice(iter(self.sampler), skip, None)
+
+    def __len__(self):
+        return len(self.sampler) - self.skip
@@ -0,0 +1,67 @@
+# Writes a small fixed dataset for train.py -bm benchmarks: either synthetic road tiles or a
+# fixed random sample of an existing dataset, laid out as <output>/train and <output>/valid
+import os
+import sys
+import cv2
+import shutil
+import argparse
+import numpy as np
+from loader import listIds
+
+
+parser = argparse.ArgumentParser(description='benchmark dataset')
+
+parser.add_argument('-n',   '--train',          type=int,   required=False, dest='train',       help='training tiles (default 96)')
+parser.add_argument('-nv',  '--valid',          type=int,   required=False, dest='valid',       help='validation tiles (default 64)')
+parser.add_argument('-sz',  '--size',           type=int,   required=False, dest='size',        help='synthetic tile size (default 64)')
+parser.add_argument('-sd',  '--seed',           type=int,   required=False, dest='seed',        help='seed of the tiles or of the sample (default 0)')
+parser.add_argument('-sp',  '--sample',         type=str,   required=False, dest='sample',      help='sample tiles from this dataset root instead of drawing them')
+parser.add_argument('output', type=str, help='directory to write train/ and valid/ into')
+
+def tile(size, rng):
+    # A smooth random background crossed by a few straight and bent roads of varying width
+    background = cv2.resize(rng.randint(40, 160, (4, 4, 3)).astype(np.uint8), (size, size), interpolation=cv2.INTER_CUBIC)
+    img = np.clip(background.astype(np.int16) + rng.randint(-12, 13, (size, size, 3)), 0, 255).astype(np.uint8)
+    mask = np.zeros((size, size), np.uint8)
+    for _ in range(rng.randint(1, 4)):
+        points = rng.randint(-size // 4, size + size // 4, (rng.randint(2, 4), 1, 2)).astype(np.int32)
+        width = int(rng.randint(2, max(3, size // 16)))
+        colour = tuple(int(c) for c in rng.randint(170, 230, 3))
+        cv2.polylines(img, [points], False, colour, width)
+        cv2.polylines(mask, [points], False, 255, width)
+    return img, mask
+
+def draw(dest, count, size, seed):
+    os.makedirs(dest, exist_ok=True)
+    for i in range(count):
+        img, mask = tile(size, np.random.RandomState([seed, i]))
+        cv2.imwrite(os.path.join(dest, '{}_sat.jpg'.format(i)), img, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        cv2.imwrite(os.path.join(dest, '{}_mask.png'.format(i)), mask)
+    return count
+
+def sample(source, dest, count, seed):
+    ids = listIds(source)
+    if count > len(ids):
+        raise ValueError('{} has {} tiles, cannot sample {}'.format(source, len(ids), count))
+    os.makedirs(dest, exist_ok=True)
+    for i in sorted(np.random.RandomState(seed).choice(len(ids), count, replace=False)):
+        for name in ('{}_sat.jpg'.format(ids[i]), '{}_mask.png'.format(ids[i])):
+            shutil.copyfile(os.path.join(source, name), os.path.join(dest, name))
+    return count
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    args.train = 96 if not args.train else args.train
+    args.valid = 64 if not args.valid else args.valid
+    args.size = 64 if not args.size else args.size
+    args.seed = 0 if not args.seed else args.seed
+
+    print('Benchmark dataset start')
+    print('Arguments -> {}'.format(' '.join(sys.argv)))
+    for split, count, seed in (('train', args.train, args.seed), ('valid', args.valid, args.seed + 1)):
+        dest = os.path.join(args.output, split)
+        if args.sample:
+            sample(os.path.join(args.sample, split), dest, count, seed)
+        else:
+            draw(dest, count, args.size, seed)
+        print('[+] wrote {} tiles into {}'.format(count, dest))
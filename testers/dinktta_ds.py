@@ -1,13 +1,19 @@
 import cv2, numpy as np
-from torch.autograd import Variable as V
 import torch
+from devices import resolve, toDevice
+from networks.fusion import fuse
 import os
 
 
 class dinktta_ds:
-    def __init__(self, net, batchsize=1):
+    def __init__(self, net, batchsize=1, device=None, memoryFormat=torch.contiguous_format, fused=True):
+        # An eval-mode network gets its BatchNorms folded into the convolutions, see networks/fusion.py
+        if fused and not net.training:
+            fuse(net)
         self.net = net
         self.batch = batchsize
+        self.device = resolve(device)
+        self.memoryFormat = memoryFormat
 
     def __call__(self, inputs):
         mask = self.batch1(inputs) if self.batch == 1 else\
@@ -29,7 +35,7 @@ class dinktta_ds:
         img4 = np.array(img3)[:,:,::-1]
         img5 = np.concatenate([img3,img4]).transpose(0,3,1,2)
         img5 = np.array(img5, np.float32)/255.0
-        img5 = V(torch.Tensor(img5).cuda())
+        img5 = toDevice(img5, self.device, self.memoryFormat)
 
         mask = self.net.forward(img5).squeeze().cpu().data.numpy()#.squeeze(1)
         mask1 = mask[:4] + mask[4:,:,::-1]
@@ -48,10 +54,10 @@ class dinktta_ds:
         img4 = np.array(img3)[:,:,::-1]
         img5 = img3.transpose(0,3,1,2)
         img5 = np.array(img5, np.float32)/255.0
-        img5 = V(torch.Tensor(img5).cuda())
+        img5 = toDevice(img5, self.device, self.memoryFormat)
         img6 = img4.transpose(0,3,1,2)
         img6 = np.array(img6, np.float32)/255.0
-        img6 = V(torch.Tensor(img6).cuda())
+        img6 = toDevice(img6, self.device, self.memoryFormat)
 
         maska = self.net.forward(img5).squeeze().cpu().data.numpy()#.squeeze(1)
         maskb = self.net.forward(img6).squeeze().cpu().data.numpy()
@@ -75,10 +81,10 @@ class dinktta_ds:
         img3 = img3.transpose(0,3,1,2)
         img4 = img4.transpose(0,3,1,2)
 
-        img1 = V(torch.Tensor(np.array(img1, np.float32)/255.0).cuda())
-        img2 = V(torch.Tensor(np.array(img2, np.float32)/255.0).cuda())
-        img3 = V(torch.Tensor(np.array(img3, np.float32)/255.0).cuda())
-        img4 = V(torch.Tensor(np.array(img4, np.float32)/255.0).cuda())
+        img1 = toDevice(np.array(img1, np.float32)/255.0, self.device, self.memoryFormat)
+        img2 = toDevice(np.array(img2, np.float32)/255.0, self.device, self.memoryFormat)
+        img3 = toDevice(np.array(img3, np.float32)/255.0, self.device, self.memoryFormat)
+        img4 = toDevice(np.array(img4, np.float32)/255.0, self.device, self.memoryFormat)
 
         maska = self.net.forward(img1).squeeze().cpu().data.numpy()
         maskb = self.net.forward(img2).squeeze().cpu().data.numpy()
@@ -103,10 +109,10 @@ class dinktta_ds:
         img3 = img3.transpose(0,3,1,2)
         img4 = img4.transpose(0,3,1,2)
 
-        img1 = V(torch.Tensor(np.array(img1, np.float32)/255.0).cuda())
-        img2 = V(torch.Tensor(np.array(img2, np.float32)/255.0).cuda())
-        img3 = V(torch.Tensor(np.array(img3, np.float32)/255.0).cuda())
-        img4 = V(torch.Tensor(np.array(img4, np.float32)/255.0).cuda())
+        img1 = toDevice(np.array(img1, np.float32)/255.0, self.device, self.memoryFormat)
+        img2 = toDevice(np.array(img2, np.float32)/255.0, self.device, self.memoryFormat)
+        img3 = toDevice(np.array(img3, np.float32)/255.0, self.device, self.memoryFormat)
+        img4 = toDevice(np.array(img4, np.float32)/255.0, self.device, self.memoryFormat)
 
         o1 = self.net.forward(img1) 
         o2 = self.net.forward(img2)
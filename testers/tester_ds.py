@@ -1,19 +1,27 @@
 import cv2
 import numpy as np
 import torch
+from devices import resolve
+from networks.fusion import fuse
 
 class tester_ds:
-    def __init__(self, net, batchsize=1):
+    def __init__(self, net, batchsize=1, device=None, memoryFormat=torch.contiguous_format, fused=True):
+        # An eval-mode network gets its BatchNorms folded into the convolutions, see networks/fusion.py
+        if fused and not net.training:
+            fuse(net)
         self.net = net
         self.batch = batchsize
+        self.device = resolve(device)
+        self.memoryFormat = memoryFormat
     
     def __call__(self, path):
         image = cv2.imread(path)
         image = np.transpose(image, (2,0,1))
-        image = torch.as_tensor(image).unsqueeze(0).float().cuda()
+        image = torch.as_tensor(image).unsqueeze(0).float().to(self.device)
+        image = image.contiguous(memory_format=self.memoryFormat)
         image /= 255.0
         # outputs = self.net(image).squeeze().squeeze().cpu().data.numpy()
-        image = self.net(image.cuda())
+        image = self.net(image)
         image = [i.squeeze().squeeze().cpu().data.numpy() for i in image]
         image = (image[0] + image[1] + image[2] + image[3] + image[4]) / 5
         image[image<0.5] = 0
@@ -0,0 +1,33 @@
+# Run from the repository root: python -m pytest tests
+import numpy as np
+import pytest
+from augments import dinkaugment as da
+from benchmarks.augment import splitHueSaturationValue, tile, HSV_LIMITS
+
+LIMITS = [HSV_LIMITS, dict(hue_shift_limit=(-100, 100), sat_shift_limit=(-100, 100), val_shift_limit=(-100, 100))]
+
+
+@pytest.mark.parametrize('limits', LIMITS)
+def test_hsv_jitter_matches_split_add_merge(limits):
+    # Same seed, same draws: the single-pass add must give the pixels of split/add/merge
+    img, mask = tile(128)
+    for seed in range(50):
+        np.random.seed(seed)
+        expected, _ = splitHueSaturationValue(img, mask, u=1.0, **limits)
+        after = np.random.get_state()[2]
+        np.random.seed(seed)
+        actual = da.randomHueSaturationValue(img, u=1.0, **limits)
+        assert np.random.get_state()[2] == after
+        np.testing.assert_array_equal(actual, expected)
+
+def test_hsv_jitter_leaves_input_alone():
+    img, _ = tile(64)
+    before = img.copy()
+    np.random.seed(0)
+    da.randomHueSaturationValue(img, u=1.0, **HSV_LIMITS)
+    np.testing.assert_array_equal(img, before)
+
+def test_hsv_jitter_skipped():
+    img, _ = tile(64)
+    np.random.seed(0)
+    assert da.randomHueSaturationValue(img, u=0.0) is img
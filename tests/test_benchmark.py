@@ -0,0 +1,56 @@
+# Run from the repository root: python -m pytest tests
+import os
+import sys
+import json
+import subprocess
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET = 3
+
+
+def script(name, *args, cwd):
+    # train.py writes weights/ and optimizers/ into the working directory, so the runs stay in cwd
+    subprocess.run([sys.executable, os.path.join(ROOT, name)] + [str(arg) for arg in args], cwd=cwd, check=True,
+                   stdout=subprocess.DEVNULL)
+
+@pytest.fixture(scope='module')
+def data(tmp_path_factory):
+    # Enough 64px tiles that one epoch outlasts the budget on a CPU
+    root = tmp_path_factory.mktemp('benchmark')
+    script('synthetic.py', '-n', 512, '-nv', 32, '-sz', 64, root, cwd=root)
+    return root
+
+def benchmark(data, tmp_path, *args):
+    path = tmp_path / 'report.json'
+    script('train.py', '-lr', 1e-3, '-b', 4, '-it', 1, '-d', 'cpu', '-nw', 0, '-dr', data, '-bm', path,
+           *args, 'FCDenseNet', cwd=tmp_path)
+    return json.loads(path.read_text())
+
+def checkSeries(series):
+    assert series
+    for point in series:
+        assert point['seconds'] >= point['train_seconds'] > 0
+        assert point['step'] > 0 and point['images'] > 0
+        assert 0 <= point['val_iou'] <= 1
+    assert [point['step'] for point in series] == sorted(point['step'] for point in series)
+
+def test_budget_stops_the_run(data, tmp_path):
+    report = benchmark(data, tmp_path, '-tb', BUDGET, '-tg', 1.0, '-ve', 8)
+    assert report['model'] == 'FCDenseNet' and report['time_budget'] == BUDGET and report['target_iou'] == 1.0
+    # An IoU of 1 is out of reach, so the budget ends the epoch early and leaves the target fields empty
+    assert not report['reached']
+    assert report['time_to_target'] is None and report['steps_to_target'] is None and report['images_to_target'] is None
+    checkSeries(report['series'])
+    assert report['series'][-1]['seconds'] >= BUDGET
+    assert report['series'][-1]['step'] < 512 // 4
+
+def test_target_stops_the_run(data, tmp_path):
+    report = benchmark(data, tmp_path, '-tg', 0.0, '-ve', 2)
+    checkSeries(report['series'])
+    # Any IoU reaches 0, so the first check stops the run and fills the target fields from it
+    first = report['series'][0]
+    assert report['reached'] and len(report['series']) == 1
+    assert report['time_to_target'] == first['seconds']
+    assert report['steps_to_target'] == first['step'] == 2
+    assert report['images_to_target'] == first['images'] == 8
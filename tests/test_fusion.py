@@ -0,0 +1,83 @@
+# Run from the repository root: python -m pytest tests
+import copy
+import importlib
+import cv2
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+import torchvision
+from benchmarks.fusion import randomizeNorms
+
+NETWORKS = ['FCDenseNet', 'DilatedDense', 'DBilinearUnet34', 'NotPreTrainedTransposeUnet34', 'TransposeUnet']
+TOLERANCE = 1e-4
+
+
+class DeepSupervised(nn.Module):
+    # The _ds testers read a list of five side outputs
+    def __init__(self, net):
+        super().__init__()
+        self.net = net
+
+    def forward(self, x):
+        out = self.net(x)
+        return [out, out * 0.9, out * 0.8, out * 0.7, out * 0.6]
+
+@pytest.fixture(autouse=True)
+def offline(monkeypatch):
+    # The Unet34 encoders ask torchvision for ImageNet weights; random ones are enough here
+    resnet34 = torchvision.models.resnet34
+    monkeypatch.setattr(torchvision.models, 'resnet34', lambda pretrained=False, **kwargs: resnet34(weights=None))
+
+@pytest.fixture(scope='module')
+def tile(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('tiles') / '0_sat.jpg')
+    rng = np.random.default_rng(0)
+    cv2.imwrite(path, cv2.GaussianBlur(rng.integers(0, 256, (128, 128, 3), dtype=np.uint8), (9, 9), 4))
+    return path
+
+def network(name):
+    torch.manual_seed(0)
+    net = getattr(importlib.import_module('networks.{}'.format(name)), name)()
+    randomizeNorms(net)
+    return net.eval()
+
+def run(tester, net, path, fused, batchsize):
+    # The tester's mask and every raw network output it computed on the way
+    tester = getattr(importlib.import_module('testers.{}'.format(tester)), tester)(net, batchsize=batchsize, fused=fused)
+    outputs = []
+    forward = tester.net.forward
+    def record(x):
+        out = forward(x)
+        outputs.append([o.clone() for o in out] if isinstance(out, list) else out.clone())
+        return out
+    # The testers call both net(x) and net.forward(x); an instance attribute catches both
+    tester.net.forward = record
+    with torch.inference_mode():
+        mask = tester(path)
+    return mask, outputs
+
+def compare(tester, net, path, batchsize):
+    plain, plainOutputs = run(tester, copy.deepcopy(net), path, False, batchsize)
+    fused, fusedOutputs = run(tester, copy.deepcopy(net), path, True, batchsize)
+    assert len(plainOutputs) == len(fusedOutputs) > 0
+    for a, b in zip(plainOutputs, fusedOutputs):
+        for x, y in zip(a if isinstance(a, list) else [a], b if isinstance(b, list) else [b]):
+            assert (x - y).abs().max().item() < TOLERANCE
+    # Thresholded masks may only differ where an output sits on the threshold
+    assert (plain != fused).mean() < 1e-3
+
+@pytest.mark.parametrize('name', NETWORKS)
+@pytest.mark.parametrize('tester,batchsize', [('tester', 1), ('dinktta', 1), ('dinktta', 8)])
+def test_fused_testers_match_unfused(name, tester, batchsize, tile):
+    compare(tester, network(name), tile, batchsize)
+
+# Only the batch-8 path of dinktta_ds reads side outputs
+@pytest.mark.parametrize('tester,batchsize', [('tester_ds', 1), ('dinktta_ds', 8)])
+def test_fused_deep_supervision_testers_match_unfused(tester, batchsize, tile):
+    compare(tester, DeepSupervised(network('NotPreTrainedTransposeUnet34')), tile, batchsize)
+
+def test_testers_fold_batchnorm(tile):
+    net = network('NotPreTrainedTransposeUnet34')
+    tester = getattr(importlib.import_module('testers.tester'), 'tester')(net)
+    assert not any(isinstance(m, nn.BatchNorm2d) for m in tester.net.modules())
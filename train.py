@@ -11,34 +11,37 @@ import torch.utils.data as data
 from datetime import datetime
 from pytz import timezone
 import math
+import json
+import time
+import contextlib
+from loader import normalize, loaderOptions, decodeSplit, ValidCache
+import distributed
+import networks
+from precision import PRECISIONS, autocast, autocastSafe, gradScaler, criterionFloat32
+from devices import resolve, configureCpu, place, stateDict, loadState
+from checkpoints import Checkpoints, rngState, setRngState, loadTrainingState
+from samplers import ShuffleSampler, SkipSampler
 #from time import time
 #from sklearn.metrics import jaccard_score as jsc
 
 class ValidDataset(data.Dataset):
-    def __init__(self):
-        self.iml = list(filter(lambda x: x.find('sat') != -1, os.listdir('valid')))
-        self.trl = list(map(lambda x: x[:-8], self.iml))
+    def __init__(self, root='valid', packed=None, raw=False, channelsLast=False):
+        from loader import Loader
+        self.loader = Loader(root, packed=packed, raw=raw, channelsLast=channelsLast)
 
     def __getitem__(self, index):
-        id = self.trl[index]
-        img = cv2.imread(os.path.join('valid', '{}_sat.jpg').format(id))
-        mask = cv2.imread(os.path.join('valid', '{}_mask.png').format(id), cv2.IMREAD_GRAYSCALE)
-        mask = np.expand_dims(mask, axis=2)
-        img = np.array(img, np.float32).transpose(2, 0, 1) / 255.0
-        mask = np.array(mask, np.float32).transpose(2, 0, 1) / 255.0
-        mask[mask >= 0.5] = 1
-        mask[mask < 0.5] = 0
-        return img, mask
+        return self.loader.load(index)
 
     def __len__(self):
-        return len(self.iml)
+        return len(self.loader)
 
 
 class Dataset(data.Dataset):
 
-    def __init__(self, test, augment=None):
+    def __init__(self, test, augment=None, packed=None, raw=False, patch=None, crops=1, roadBias=0.0, shards=None, root='train', channelsLast=False):
         from loader import Loader
-        self.loader = Loader('train', test, augment)
+        self.loader = Loader(root, test, augment, packed=packed, raw=raw, patch=patch, crops=crops,
+                             roadBias=roadBias, shards=shards, channelsLast=channelsLast)
 
     def __getitem__(self, index):
         return self.loader(index)
@@ -52,100 +55,219 @@ parser = argparse.ArgumentParser(description='trainer')
 parser.add_argument('-lr',  '--learning_rate',  type=float, required=True,  dest='lr',          help='learning rate')
 parser.add_argument('-b',   '--batch',          type=int,   required=True,  dest='batch',       help='batch size')
 parser.add_argument('-it',  '--iterations',     type=int,   required=True,  dest='iterations',  help='# of iterations')
-parser.add_argument('-dv',  '--devices',        type=str,   required=True,  dest='devices',     help='gpu indices sep. by comma')
+parser.add_argument('-dv',  '--devices',        type=str,   required=False, dest='devices',     help='gpu indices sep. by comma')
+parser.add_argument('-d',   '--device',         type=str,   required=False, dest='device',      help='cpu or cuda:N (default: first of -dv, else cuda when available)')
+parser.add_argument('-tt',  '--threads',        type=int,   required=False, dest='threads',     help='intra-op CPU threads when training on cpu')
+parser.add_argument('-k',   '--keep',           type=int,   required=False, dest='keep',        default=1, help='checkpoints kept per metric')
+parser.add_argument('-vc',  '--valid-cache',    action='store_true',        dest='validCache',  help='decode the validation split once and keep it in memory (memory-mapped with -pk)')
+parser.add_argument('-ve',  '--valid-every',    type=int,   required=False, dest='validEvery',  help='also validate every this many optimizer steps')
+parser.add_argument('-vs',  '--valid-subset',   type=int,   required=False, dest='validSubset', help='validate on a fixed random subset of this many tiles at -ve steps, without checkpointing')
+parser.add_argument('-gc',  '--grad-checkpoint', type=str,  required=False, dest='checkpointing', choices=('blocks', 'stages'), help='recompute activations in backward per block or per stage to save memory')
+parser.add_argument('-me',  '--memory-efficient', action='store_true',      dest='memoryEfficient', help='DenseBlocks share one feature buffer and recompute BN-ReLU in backward')
+parser.add_argument('-cp',  '--compile',        type=str,   required=False, dest='compile',     choices=('auto', 'compile', 'script'), help='run the network compiled: torch.compile, TorchScript, or auto (compile, falling back to TorchScript)')
+parser.add_argument('-mb',  '--max-batch',      type=int,   required=False, dest='maxBatch',    help='samples per card and micro-batch (default 4); raise it with -gc')
+parser.add_argument('-dr',  '--data-root',      type=str,   required=False, dest='data',        help='directory holding the train/ and valid/ splits (default: .)')
+parser.add_argument('-bm',  '--benchmark',      type=str,   required=False, dest='benchmark',   help='write a time-to-target JSON report to this path')
+parser.add_argument('-tg',  '--target-iou',     type=float, required=False, dest='target',      help='with -bm, stop once validation IoU reaches this')
+parser.add_argument('-tb',  '--time-budget',    type=float, required=False, dest='budget',      help='with -bm, stop after this many seconds of training')
+parser.add_argument('-rs',  '--resume',         type=str,   required=False, dest='resume',      help='training state file to continue from (weights/state_<model>.pth)')
+parser.add_argument('-se',  '--state-every',    type=int,   required=False, dest='stateEvery',  help='also write the training state every this many optimizer steps')
 parser.add_argument('-lw',  '--lweights',       type=str,   required=False, dest='lweights',    help='name of weights file to load')
 parser.add_argument('-ls',  '--loss',           type=str,   required=False, dest='loss',        help='name of loss')
 parser.add_argument('-e',   '--epoch',          type=int,   required=False, dest='epoch',       help='epoch to start')
 parser.add_argument('-au',   '--augment',       action='store_true',        dest='augment',     help='Whether to do training augmentation')
-parser.add_argument('model', type=str, help='name of model')
+parser.add_argument('-ba',  '--batch-augment',  action='store_true',        dest='batchAugment', help='Augment whole batches on the device instead of per sample')
+parser.add_argument('-pk',  '--packed',         type=str,   required=False, dest='packed',      help='directory with splits packed by pack.py')
+parser.add_argument('-sh',  '--shards',         type=str,   required=False, dest='shards',      help='train on augmented variants written by materialize.py')
+parser.add_argument('-u8',  '--uint8',          action='store_true',        dest='uint8',       help='Load uint8 samples and normalize once per batch on the device')
+parser.add_argument('-cl',  '--channels-last',  action='store_true',        dest='channelsLast', help='NHWC (channels_last) model, batches and activations')
+parser.add_argument('-nw',  '--workers',        type=int,   required=False, dest='workers',     help='DataLoader worker processes (default: cores - 1, at most 8)')
+parser.add_argument('-pf',  '--prefetch',       type=int,   required=False, dest='prefetch',    help='batches prefetched per worker')
+parser.add_argument('-rt',  '--road-temperature', type=float, required=False, dest='roadTemperature', help='oversample road-rich tiles, 1 = proportional to road fraction')
+parser.add_argument('-ec',  '--empty-cap',      type=float, required=False, dest='emptyCap',    help='max share of road-free tiles per epoch (with -rt)')
+parser.add_argument('-ps',  '--patch-size',     type=int,   required=False, dest='patch',       help='train on random crops of this size instead of full tiles')
+parser.add_argument('-pn',  '--patches',        type=int,   required=False, dest='crops',       help='crops taken from every decoded tile (with -ps, default 4)')
+parser.add_argument('-pb',  '--patch-road-bias', type=float, required=False, dest='roadBias',   help='probability of centring a crop on a road pixel (with -ps)')
+parser.add_argument('-pr',  '--precision',      type=str,   required=False, dest='precision',   choices=PRECISIONS, default='fp32', help='autocast precision for forward and loss')
+parser.add_argument('-ddp', '--distributed',   action='store_true',        dest='distributed', help='DistributedDataParallel, one process per device (start with torchrun or -np)')
+parser.add_argument('-np',  '--nproc',          type=int,   required=False, dest='nproc',       help='spawn this many local processes and train with -ddp')
+parser.add_argument('-bk',  '--backend',        type=str,   required=False, dest='backend',     choices=('nccl', 'gloo'), help='torch.distributed backend (default nccl with GPUs, gloo without)')
+parser.add_argument('model', type=str, help='name of model, or path of a pickled network (see prune.py)')
 
 MAX_BATCH_PER_CARD = 4
 SMOOTH = 1e-6
 
 minValLoss = float('inf')
 maxValAcc = 0.0
+
+def log(*messages):
+    # Only the first process reports under -ddp
+    if distributed.isMain():
+        print(*messages)
+
 def iou(outputs, labels):
-    outputs = outputs >= 0.5
-    labels = labels >= 0.5
-    acc = 0
-    for out, lab in zip(outputs, labels):
-        intersection = (lab & out).int().sum().float().item() + SMOOTH
-        union = (lab | out).int().sum().float().item() + SMOOTH
-        acc += (intersection/union)
-    ret = acc / len(outputs)
-    return ret
-
-def validate():
+    # Mean per-sample IoU of a batch as a 0-dim tensor on the batch's device; reading it back
+    # is left to the caller so the training loop does not synchronise on every micro-batch
+    outputs = (outputs >= 0.5).flatten(1)
+    labels = (labels >= 0.5).flatten(1)
+    intersection = (labels & outputs).sum(1).float() + SMOOTH
+    union = (labels | outputs).sum(1).float() + SMOOTH
+    return (intersection / union).mean()
+
+def save(metric, value, mode='min', withOptimizer=False):
+    # weights/<metric>_<value>.pth, kept while it ranks in the top -k of metric
+    checkpoints.save(metric, value, '{}_{:.5f}.pth'.format(metric, value), stateDict(model),
+                     optimizer.state_dict() if withOptimizer else None, epoch=epoch, mode=mode)
+
+def validate(subset=None):
+    # The full validation set makes checkpoint decisions; a subset loader only reports
     global minValLoss
     global maxValAcc
+    loader = validloader if subset is None else subset
+    # Forward through the wrapped module: DDP's forward broadcasts buffers, which would
+    # need every rank to run the same number of validation batches
+    net = model.module if args.distributed else model
     model.eval()
-    print("[+] Validating.. - {}".format(datetime.now(timezone("US/Pacific")).strftime("%m-%d-%Y - %I:%M %p")))
-    running_loss = 0
-    running_acc = 0
+    log("[+] Validating{}.. - {}".format(' subset' if subset is not None else '', datetime.now(timezone("US/Pacific")).strftime("%m-%d-%Y - %I:%M %p")))
+    # Device-side accumulators, read back once after the loop
+    running_loss = torch.zeros((), device=device)
+    running_acc = torch.zeros((), device=device)
     counter = batch_multiplier
-    batchloss = 0
-    batchacc  = 0
+    batchloss = torch.zeros((), device=device)
+    batchacc = torch.zeros((), device=device)
     batchcount = 0
-    for i, (inputs, labels) in enumerate(validloader, 1):
-        if len(validloader) + 1 - i < args.batch:
+    for i, (inputs, labels) in enumerate(loader, 1):
+        if subset is None and len(loader) + 1 - i < args.batch:
             break
-        inputs = inputs.cuda()
-        labels = labels.cuda()
+        inputs = inputs.to(device, non_blocking=True)
+        labels = labels.to(device, non_blocking=True)
+        if args.uint8 or args.validCache:
+            inputs, labels = normalize(inputs, labels, memoryFormat)
         if counter == 0:
             counter = batch_multiplier
             running_loss += batchloss
             running_acc += batchacc
             batchcount += 1
-            batchloss = 0
-            batchacc = 0
-
-        outputs = model(inputs)
-        loss = criterion(outputs, labels).item() / batch_multiplier
-        acc = iou(outputs, labels) / batch_multiplier
-        batchloss += loss
-        batchacc += acc
+            batchloss.zero_()
+            batchacc.zero_()
+
+        with autocast(inputs.device, args.precision):
+            outputs = net(inputs)
+            loss = criterionFloat32(criterion, outputs, labels) / batch_multiplier
+        batchloss += loss.float()
+        batchacc += iou(outputs, labels) / batch_multiplier
         counter -= 1
+    if counter == 0:
+        running_loss += batchloss
+        running_acc += batchacc
+        batchcount += 1
+
+    running_loss = distributed.average(running_loss / batchcount, device) * batchcount
+    running_acc = distributed.average(running_acc / batchcount, device) * batchcount
+    model.train()
+    if not distributed.isMain():
+        return running_loss / batchcount, running_acc / batchcount
+    if subset is not None:
+        print('[=] validation subset -- loss {:.5f} acc {:.5f}\n'.format(running_loss / batchcount, running_acc / batchcount))
+        return running_loss / batchcount, running_acc / batchcount
 
     if running_loss / batchcount < minValLoss:
         print('[+] validation -- new better loss  {:.5f} -> {:.5f}\n'.format(minValLoss, running_loss / batchcount))
-        old_path = 'weights/val_loss_{}_{}_{:.5f}.pth'.format(args.model, criterion.__class__.__name__, minValLoss)
-        if os.path.exists(old_path):
-            os.system('rm ' + old_path)
         minValLoss = running_loss / batchcount
-        savepath = 'weights/val_loss_{}_{}_{:.5f}.pth'.format(args.model, criterion.__class__.__name__, minValLoss)
-        torch.save(model.state_dict(), savepath)
     else:
         print("[-] validation -- loss {:.5f}\n".format(running_loss / batchcount))
+    save('val_loss_{}_{}'.format(args.model, criterion.__class__.__name__), running_loss / batchcount)
 
 
     if running_acc / batchcount > maxValAcc:
         print('[+] validation -- new better acc  {:.5f} -> {:.5f}\n'.format(maxValAcc, running_acc / batchcount))
-        old_path = 'weights/val_acc_{}_{}_{:.5f}.pth'.format(args.model, "iouscore", maxValAcc)
-        if os.path.exists(old_path):
-            os.system('rm ' + old_path)
         maxValAcc = running_acc / batchcount
-        savepath = 'weights/val_acc_{}_{}_{:.5f}.pth'.format(args.model, "iouscore", maxValAcc)
-        torch.save(model.state_dict(), savepath)
     else:
         print("[-] validation -- acc {:.5f}\n".format(running_acc / batchcount))
-
-    model.train()
+    save('val_acc_{}_{}'.format(args.model, "iouscore"), running_acc / batchcount, mode='max')
+    return running_loss / batchcount, running_acc / batchcount
+
+def probe(loss, acc, full):
+    # Adds a point to the -bm time series and tells whether the target or the budget is reached;
+    # all ranks decide together since their clocks differ
+    global validSeconds
+    validSeconds += time.perf_counter() - validStart
+    seconds = time.perf_counter() - trainStart
+    trained = seconds - validSeconds
+    report['series'].append(dict(seconds=seconds, train_seconds=trained, epoch=epoch, step=steps,
+                                 images=seen * world, images_per_sec=seen * world / trained,
+                                 val_loss=loss, val_iou=acc, subset=not full))
+    if args.target is not None and acc >= args.target and report['time_to_target'] is None:
+        report.update(reached=True, time_to_target=seconds, steps_to_target=steps, images_to_target=seen * world)
+    stop = report['reached'] or (args.budget is not None and seconds >= args.budget)
+    if distributed.isMain():
+        with open(args.benchmark + '.tmp', 'w') as f:
+            json.dump(report, f, indent=1)
+        os.replace(args.benchmark + '.tmp', args.benchmark)
+    return distributed.average(float(stop), device) > 0
+
+def outOfTime():
+    # -tb is checked after every optimizer step, not only at -ve points; all ranks decide together
+    if args.budget is None:
+        return False
+    return distributed.average(float(time.perf_counter() - trainStart >= args.budget), device) > 0
 
 args = parser.parse_args()
 
 args.epoch = 1 if not args.epoch else args.epoch
+args.crops = 4 if not args.crops else args.crops
+args.roadBias = 0.0 if not args.roadBias else args.roadBias
+args.data = '.' if not args.data else args.data
+if args.maxBatch is not None and args.maxBatch <= 0:
+    parser.error('-mb must be a positive number of samples')
+MAX_BATCH_PER_CARD = args.maxBatch if args.maxBatch else MAX_BATCH_PER_CARD
+
+if args.nproc and not distributed.launched():
+    sys.exit(distributed.spawn(args.nproc))
+args.distributed = args.distributed or distributed.launched()
 
 # Get Attributes From Modules
-model = importlib.import_module('networks.{}'.format(args.model))
+model = networks.load(args.model)
+# Checkpoints, state files and reports are named after a pickled network's file name
+args.model = networks.label(args.model)
 
-model = getattr(model, args.model)()
+if args.precision != 'fp32':
+    autocastSafe(model)
+
+if args.memoryEfficient:
+    from networks.layers import memoryEfficient
+    if not memoryEfficient(model):
+        parser.error('-me needs a network built from DenseBlocks')
+
+if args.checkpointing:
+    from networks import checkpointing
+    checkpointing.enable(model, args.checkpointing)
 
 augment = None
 
+if args.augment and args.batchAugment:
+    parser.error('-au and -ba are alternatives, pick one')
+if args.augment and args.shards:
+    parser.error('-sh shards are already augmented, drop -au')
+if (args.target is not None or args.budget is not None) and not args.benchmark:
+    parser.error('-tg and -tb need -bm')
+if args.validSubset and not args.validEvery:
+    parser.error('-vs needs -ve')
+if args.emptyCap is not None and not args.roadTemperature:
+    parser.error('-ec needs -rt')
+if args.validSubset and args.validSubset < args.batch:
+    parser.error('-vs must be at least the batch size')
+
 if args.augment:
     augment = importlib.import_module('augments.{}'.format('dinkaugment'))
     augment = getattr(augment, 'augment')
 
+batchAugment = None
+
+if args.batchAugment:
+    batchAugment = importlib.import_module('augments.{}'.format('batchaugment'))
+    batchAugment = getattr(batchAugment, 'augment')
+
 criterion = None
 
 if args.loss:
@@ -155,95 +277,261 @@ if args.loss:
 # Get Attributes From Modules End
 
 ids = [int(x) for x in args.devices.split(',')] if args.devices else None
-
-torch.cuda.set_device(ids[0])
-model = torch.nn.DataParallel(model, device_ids=ids)
-model.cuda()
+# With -cl the model is converted once and every batch arrives NHWC: float samples are collated
+# straight into channels_last views, -u8 batches are channels_last once permuted by normalize
+memoryFormat = torch.channels_last if args.channelsLast else torch.contiguous_format
+floatChannelsLast = args.channelsLast and not args.uint8
+
+if args.distributed:
+    # One process per device; checkpoints keep DataParallel's 'module.' prefix
+    if args.device:
+        device = torch.device(args.device)
+        if device.type == 'cuda' and device.index is None:
+            device = torch.device('cuda', int(os.environ.get('LOCAL_RANK', 0)))
+    elif ids and torch.cuda.is_available():
+        device = torch.device('cuda', ids[int(os.environ.get('LOCAL_RANK', 0)) % len(ids)])
+    else:
+        device = torch.device('cpu')
+    backend = args.backend or ('nccl' if device.type == 'cuda' else 'gloo')
+    rank, world = distributed.setup(backend)
+    if device.type == 'cuda':
+        torch.cuda.set_device(device)
+    model.to(device, memory_format=memoryFormat)
+    model = torch.nn.parallel.DistributedDataParallel(model, device_ids=[device.index] if device.type == 'cuda' else None)
+    cards = 1
+else:
+    device = resolve(args.device, ids)
+    model = place(model, device, ids if device.type == 'cuda' else None, channelsLast=args.channelsLast)
+    cards, world, rank = len(ids) if ids and device.type == 'cuda' else 1, 1, 0
+
+# An optimizer step accumulates whole micro-batches of world * cards * MAX_BATCH_PER_CARD samples
+if args.batch <= 0 or args.batch % (world * cards * MAX_BATCH_PER_CARD):
+    parser.error('-b {} must be a positive multiple of {} ({} processes x {} cards x {} per card, see -mb)'.format(
+        args.batch, world * cards * MAX_BATCH_PER_CARD, world, cards, MAX_BATCH_PER_CARD))
+
+if device.type == 'cpu' and args.threads:
+    configureCpu(args.threads)
+
+if args.compile:
+    # Padded to the validation batch in eval mode so a short last batch does not recompile
+    from compiling import compileModel
+    model = compileModel(model, args.compile, batch=cards * 4)
+
+scaler = gradScaler(device, args.precision)
+checkpoints = Checkpoints(keep=args.keep, fresh=not args.resume) if distributed.isMain() else None
 
 optimizer = optim.RMSprop(model.parameters(), lr=args.lr, weight_decay=1e-4)
 if args.lweights:
-    model.load_state_dict(torch.load("weights/{}".format(args.lweights)))
+    loadState(model, torch.load("weights/{}".format(args.lweights), map_location=device))
     optimizer = optim.RMSprop(model.parameters(), lr=args.lr, weight_decay=1e-4)
-    optimizer.load_state_dict(torch.load("optimizers/{}".format(args.lweights)))
-
-dataset = Dataset(test=False, augment=augment)
+    optimizer.load_state_dict(torch.load("optimizers/{}".format(args.lweights), map_location=device))
+
+# Resuming restores everything needed to continue the interrupted run exactly where it stopped:
+# weights, optimizer, scaler, best-metric trackers, RNG streams and the position in the epoch
+state = loadTrainingState(args.resume) if args.resume else None
+if state:
+    loadState(model, state['model'])
+    optimizer.load_state_dict(state['optimizer'])
+    scaler.load_state_dict(state['scaler'])
+    # Gradients accumulated before the state was written: the unfinished group of an epoch's last
+    # micro-batches, which the next epoch's first optimizer step includes
+    for parameter, grad in zip(model.parameters(), state.get('grads') or []):
+        parameter.grad = None if grad is None else grad.to(parameter.device)
+    minValLoss, maxValAcc = state['minValLoss'], state['maxValAcc']
+    args.epoch = state['epoch']
+
+packedSplit = lambda split: os.path.join(args.packed, split) if args.packed else None
+
+# With -ps every tile in a batch contributes args.crops patches, so a step sees
+# world * cards * MAX_BATCH_PER_CARD * args.crops samples
+dataset = Dataset(test=False, augment=augment, packed=packedSplit('train'), raw=args.uint8,
+                  patch=args.patch, crops=args.crops, roadBias=args.roadBias, shards=args.shards,
+                  root=os.path.join(args.data, 'train'), channelsLast=floatChannelsLast)
+
+seed = state['seed'] if state else int(torch.randint(2**31, ()))
+sampler = None
+if args.distributed:
+    if args.roadTemperature:
+        parser.error('-rt is not supported together with -ddp')
+    sampler = data.distributed.DistributedSampler(dataset, shuffle=True)
+if args.roadTemperature:
+    from samplers import RoadDensitySampler, roadFractions
+    sampler = RoadDensitySampler(roadFractions(dataset.loader), args.roadTemperature, args.emptyCap, seed=seed)
+if args.shards:
+    from samplers import VariantSampler
+    sampler = VariantSampler(sampler or ShuffleSampler(len(dataset), seed), len(dataset), dataset.loader.variants)
+# Every epoch's order is a function of the epoch, so a resumed epoch skips what was already seen
+sampler = SkipSampler(sampler or ShuffleSampler(len(dataset), seed),
+                      state['batches'] * cards * MAX_BATCH_PER_CARD if state else 0)
+
+# Loaders draw their worker seeds and the validation order from their own generators: persistent
+# workers take a base seed only when a loader is first iterated, which a resumed process does at
+# other points than the run it continues, so drawing from the global stream would shift it
+loaderSeeds = torch.Generator().manual_seed(seed)
+validOrder = torch.Generator().manual_seed(seed)
+if state and 'validOrder' in state:
+    validOrder.set_state(state['validOrder'])
 
 trainloader = torch.utils.data.DataLoader(
     dataset,
-    batch_size=len(ids) * MAX_BATCH_PER_CARD,
-    shuffle=True)
-
-validloader = torch.utils.data.DataLoader(ValidDataset(), batch_size=len(ids) * 4, shuffle=True)
+    batch_size=cards * MAX_BATCH_PER_CARD,
+    sampler=sampler,
+    generator=loaderSeeds,
+    **loaderOptions(device, args.workers, args.prefetch, floatChannelsLast))
+
+validset = ValidDataset(os.path.join(args.data, 'valid'), packed=packedSplit('valid'), raw=args.uint8, channelsLast=floatChannelsLast)
+# Fixed across epochs and runs so quick checks stay comparable
+subsetIds = np.random.RandomState(0).choice(len(validset), args.validSubset, replace=False) if args.validSubset else None
+if args.validCache:
+    from loader import Loader
+    images, masks = decodeSplit(Loader(os.path.join(args.data, 'valid'), packed=packedSplit('valid')))
+    validloader = ValidCache(images, masks, cards * 4, np.arange(len(images))[rank::world])
+    subsetloader = ValidCache(images, masks, cards * 4, np.sort(subsetIds)[rank::world]) if args.validSubset else None
+else:
+    validsampler = data.distributed.DistributedSampler(validset, shuffle=True) if args.distributed else data.RandomSampler(validset, generator=validOrder)
+    validloader = torch.utils.data.DataLoader(validset, batch_size=cards * 4, sampler=validsampler, generator=loaderSeeds,
+                                              **loaderOptions(device, args.workers, args.prefetch, floatChannelsLast))
+    subsetloader = None
+    if args.validSubset:
+        subsetsampler = data.distributed.DistributedSampler(data.Subset(validset, subsetIds), shuffle=False) if args.distributed else None
+        subsetloader = torch.utils.data.DataLoader(data.Subset(validset, subsetIds), batch_size=cards * 4, sampler=subsetsampler, generator=loaderSeeds,
+                                                   **loaderOptions(device, args.workers, args.prefetch, floatChannelsLast))
 
 criterion = nn.BCELoss() if not criterion else criterion
 
-print('Training start')
-print('Arguments -> {}'.format(' '.join(sys.argv)))
-batch_multiplier = args.batch / (len(ids) * MAX_BATCH_PER_CARD)
-
-minTrainLoss = float('inf')
-maxTrainAcc = 0
-for epoch in range(args.epoch, args.iterations + args.epoch):
-    print("[+] Epoch ({}/{}) - {}".format(epoch, args.iterations + args.epoch,
+log('Training start')
+log('Arguments -> {}'.format(' '.join(sys.argv)))
+batch_multiplier = args.batch // (world * cards * MAX_BATCH_PER_CARD)
+
+def saveState(epoch, batches):
+    # Written by the checkpoint thread; batches counts the micro-batches of epoch already trained.
+    # Mid-epoch states are taken right after an optimizer step, so grads only holds gradients
+    # at the end of an epoch
+    checkpoints.saveState('state_{}.pth'.format(args.model), dict(
+        model=stateDict(model), optimizer=optimizer.state_dict(), scaler=scaler.state_dict(),
+        grads=[parameter.grad for parameter in model.parameters()],
+        epoch=epoch, end=end, batches=batches, batchcount=batchcount, steps=steps, seed=seed,
+        running_loss=float(running_loss), running_acc=float(running_acc),
+        minTrainLoss=minTrainLoss, maxTrainAcc=maxTrainAcc, minValLoss=minValLoss, maxValAcc=maxValAcc,
+        validOrder=validOrder.get_state(), rng=rngState()))
+
+minTrainLoss = state['minTrainLoss'] if state else float('inf')
+maxTrainAcc = state['maxTrainAcc'] if state else 0
+end = state['end'] if state else args.iterations + args.epoch
+if state:
+    setRngState(state['rng'])
+
+# -bm bookkeeping: optimizer steps and training samples since the start, and the time spent validating
+report = dict(model=args.model, loss=criterion.__class__.__name__, device=str(device), world=world,
+              torch=torch.__version__, config=vars(args), target_iou=args.target, time_budget=args.budget,
+              reached=False, time_to_target=None, steps_to_target=None, images_to_target=None, series=[])
+# -ve and -se count optimizer steps across epochs, so the spacing does not depend on the epoch length
+steps, seen, stop = state.get('steps', 0) if state else 0, 0, False
+# A pickled network (prune.py) may arrive in eval mode; BatchNorm must train from the first step
+model.train()
+trainStart = time.perf_counter()
+validSeconds = 0.0
+for epoch in range(args.epoch, end):
+    log("[+] Epoch ({}/{}) - {}".format(epoch, end,
                                           datetime.now(timezone("US/Pacific")).strftime("%m-%d-%Y - %I:%M %p")))
-    running_loss = 0
-    running_acc = 0
+    sampler.set_epoch(epoch)
+    # Device-side accumulators, read back once at the end of the epoch
+    running_loss = torch.zeros((), device=device)
+    running_acc = torch.zeros((), device=device)
     counter = batch_multiplier
-    batchloss = 0
-    batchacc = 0
+    batchloss = torch.zeros((), device=device)
+    batchacc = torch.zeros((), device=device)
     batchcount = 0
-    for i, (inputs, labels) in enumerate(trainloader, 1):
-        if (len(trainloader) - i + 1) < args.batch:
+    skipped = 0
+    total = len(trainloader)
+    batches = iter(trainloader)
+    if state and state['batches']:
+        skipped, batchcount = state['batches'], state['batchcount']
+        running_loss += state['running_loss']
+        running_acc += state['running_acc']
+        total += skipped
+    state = None
+    for i, (inputs, labels) in enumerate(batches, skipped + 1):
+        if (total - i + 1) < args.batch:
             break
-        inputs = inputs.cuda()
-        labels = labels.cuda()
         if counter == 0:
-            optimizer.step()
+            scaler.step(optimizer)
+            scaler.update()
             optimizer.zero_grad()
             counter = batch_multiplier
             running_loss += batchloss
             running_acc += batchacc
             batchcount += 1
-            batchloss = 0
-            batchacc = 0
+            steps += 1
+            batchloss.zero_()
+            batchacc.zero_()
+            # An exhausted budget validates once more, so the report ends with a point at the budget
+            if (args.validEvery and steps % args.validEvery == 0) or outOfTime():
+                validStart = time.perf_counter()
+                with torch.no_grad():
+                    valLoss, valAcc = validate(subsetloader)
+                if args.benchmark and probe(valLoss, valAcc, subsetloader is None):
+                    stop = True
+                    break
+            # Before this batch draws any random numbers, so a restart replays it exactly
+            if args.stateEvery and steps % args.stateEvery == 0 and checkpoints is not None:
+                saveState(epoch, i - 1)
+        if args.patch:
+            inputs = inputs.flatten(0, 1)
+            labels = labels.flatten(0, 1)
+        inputs = inputs.to(device, non_blocking=True)
+        labels = labels.to(device, non_blocking=True)
+        if args.uint8:
+            inputs, labels = normalize(inputs, labels, memoryFormat)
+        if batchAugment:
+            with torch.no_grad():
+                inputs, labels = batchAugment(inputs, labels)
+            inputs = inputs.contiguous(memory_format=memoryFormat)
         counter -= 1
-        outputs = model(inputs)
-        loss = criterion(outputs, labels) / batch_multiplier
-        loss.backward()
+        # Under -ddp only the micro-batch right before an optimizer step all-reduces gradients
+        with model.no_sync() if args.distributed and counter != 0 else contextlib.nullcontext():
+            with autocast(inputs.device, args.precision):
+                outputs = model(inputs)
+                loss = criterionFloat32(criterion, outputs, labels) / batch_multiplier
+            scaler.scale(loss).backward()
         with torch.no_grad():
-            acc = iou(outputs, labels) / batch_multiplier
-        batchloss += loss.item()
-        batchacc += acc
-
-    if running_loss / batchcount < minTrainLoss:
-        print('[+] train -- new better loss  {:.5f} -> {:.5f}\n'.format(minTrainLoss, running_loss / batchcount))
-        old_path = 'weights/train_loss_{}_{}_{:.5f}.pth'.format(args.model, criterion.__class__.__name__, minTrainLoss)
-        if os.path.exists(old_path):
-            os.system('rm ' + old_path)
-            os.system('rm ' + old_path.replace('weights', 'optimizers'))
-        minTrainLoss = running_loss / batchcount
-        savepath = 'weights/train_loss_{}_{}_{:.5f}.pth'.format(args.model, criterion.__class__.__name__, minTrainLoss)
-        torch.save(model.state_dict(), savepath)
-        torch.save(optimizer.state_dict(), savepath.replace("weights", "optimizers"))
-    else:
-        print("[-] train -- loss {:.5f}\n".format(running_loss / batchcount))
-
-    assert not math.isnan(maxTrainAcc)
-    assert not math.isnan(running_acc)
-    assert not math.isnan(batchcount)
-    assert not math.isnan(running_acc/batchcount)
-    if running_acc / batchcount > maxTrainAcc:
-        print('[+] train -- new better acc  {:.5f} -> {:.5f}\n'.format(maxTrainAcc, running_acc / batchcount))
-        old_path = 'weights/train_acc_{}_{}_{:.5f}.pth'.format(args.model, "iouscore", maxTrainAcc)
-        if os.path.exists(old_path):
-            os.system('rm ' + old_path)
-        maxTrainAcc = running_acc / batchcount
-        savepath = 'weights/train_acc_{}_{}_{:.5f}.pth'.format(args.model, "iouscore", maxTrainAcc)
-        torch.save(model.state_dict(), savepath)
-    else:
-        print("[-] train -- acc {:.5f}\n".format(running_acc / batchcount))
-
+            batchloss += loss.detach().float()
+            batchacc += iou(outputs, labels) / batch_multiplier
+        seen += inputs.size(0)
+    if stop:
+        break
+
+    running_loss = distributed.average(running_loss / batchcount, device) * batchcount
+    running_acc = distributed.average(running_acc / batchcount, device) * batchcount
+    if distributed.isMain():
+        if running_loss / batchcount < minTrainLoss:
+            print('[+] train -- new better loss  {:.5f} -> {:.5f}\n'.format(minTrainLoss, running_loss / batchcount))
+            minTrainLoss = running_loss / batchcount
+        else:
+            print("[-] train -- loss {:.5f}\n".format(running_loss / batchcount))
+        save('train_loss_{}_{}'.format(args.model, criterion.__class__.__name__), running_loss / batchcount, withOptimizer=True)
+
+        assert not math.isnan(maxTrainAcc)
+        assert not math.isnan(running_acc)
+        assert not math.isnan(batchcount)
+        assert not math.isnan(running_acc/batchcount)
+        if running_acc / batchcount > maxTrainAcc:
+            print('[+] train -- new better acc  {:.5f} -> {:.5f}\n'.format(maxTrainAcc, running_acc / batchcount))
+            maxTrainAcc = running_acc / batchcount
+        else:
+            print("[-] train -- acc {:.5f}\n".format(running_acc / batchcount))
+        save('train_acc_{}_{}'.format(args.model, "iouscore"), running_acc / batchcount, mode='max')
+
+    validStart = time.perf_counter()
     with torch.no_grad():
-        validate()
-
-print('Finished Training')
+        valLoss, valAcc = validate()
+    stop = bool(args.benchmark) and probe(valLoss, valAcc, True)
+    if checkpoints is not None:
+        saveState(epoch + 1, 0)
+    if stop:
+        break
+
+if checkpoints is not None:
+    checkpoints.close()
+log('Finished Training')
+distributed.cleanup()
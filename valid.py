@@ -2,97 +2,37 @@
 
 import os
 import sys
-import cv2
-import numpy as np
 import argparse
 import importlib
 import torch
 import torch.utils.data as data
 from datetime import datetime
 from pytz import timezone
+import networks
+from loader import loaderOptions
+from metrics import iou, f1, recall, precision
+from devices import resolve, configureCpu, place, loadState
 
 
 parser = argparse.ArgumentParser(description='tester')
 
-parser.add_argument('-wt',  '--weights',        type=str,   required=True,  dest='weights',     help='path to weights file')
+parser.add_argument('-wt',  '--weights',        type=str,   required=False, dest='weights',     help='path to weights file')
+parser.add_argument('-qt',  '--quantized',      type=str,   required=False, dest='quantized',   help='int8 TorchScript network written by quantize.py, run on the CPU instead of -wt')
 parser.add_argument('-tta', '--augment',        action='store_true',        dest='tta',         help='Augmentation?')
-parser.add_argument('-dv',  '--devices',        type=str,   required=True,  dest='devices',     help='gpu indices sep. by comma')
+parser.add_argument('-dv',  '--devices',        type=str,   required=False, dest='devices',     help='gpu indices sep. by comma')
+parser.add_argument('-d',   '--device',         type=str,   required=False, dest='device',      help='cpu or cuda:N (default: first of -dv, else cuda when available)')
+parser.add_argument('-tn',  '--tuned',          action='store_true',        dest='tuned',       help='CPU throughput mode: channels_last and explicit thread counts')
+parser.add_argument('-cl',  '--channels-last',  action='store_true',        dest='channelsLast', help='NHWC (channels_last) model and inputs on any device; implied by -tn')
+parser.add_argument('-tt',  '--threads',        type=int,   required=False, dest='threads',     help='intra-op CPU threads with -tn (default: all cores)')
+parser.add_argument('-ti',  '--interop',        type=int,   required=False, dest='interop',     help='inter-op CPU threads with -tn (default: 1)')
+parser.add_argument('-nf',  '--no-fuse',        action='store_true',        dest='unfused',     help='keep BatchNorm separate from the convolutions (folded by default)')
+parser.add_argument('-cp',  '--compile',        type=str,   required=False, dest='compile',     choices=('auto', 'compile', 'script'), help='run the network compiled: torch.compile, TorchScript, or auto (compile, falling back to TorchScript)')
 parser.add_argument('-s',   '--stats',          type=int,   required=False, dest='stats',       help='print statistics')
-parser.add_argument('model', type=str, help='name of model')
-
-SMOOTH = 1e-6
+parser.add_argument('-nw',  '--workers',        type=int,   required=False, dest='workers',     help='DataLoader worker processes (default: cores - 1, at most 8)')
+parser.add_argument('-pf',  '--prefetch',       type=int,   required=False, dest='prefetch',    help='batches prefetched per worker')
+parser.add_argument('model', type=str, help='name of model, or path of a pickled network (see prune.py)')
 
 labelDir = 'test'
-def iou(outputImage, filename):
-    labelFilePath = os.path.join(labelDir, filename.replace("_sat.jpg", "_mask.png")) # Gives us labelDir/id_mask.png ( True Mask )
-    labelImage = cv2.imread(labelFilePath, cv2.IMREAD_GRAYSCALE)/255.0 # Reads labelDir/true_mask.png as grey scale
-    outputImage = cv2.cvtColor(outputImage, cv2.COLOR_BGR2GRAY)/255.0 # Convert RGB Numpy Output To GreyScale
-    # Convert to Tensor
-    labelImage = torch.from_numpy(labelImage)
-    outputImage = torch.from_numpy(outputImage)
-    # Thresh hold
-    labelImage = labelImage >= 0.5
-    outputImage = outputImage >= 0.5
-    intersection = (labelImage & outputImage).int().sum().float().item()
-    union = (labelImage | outputImage).int().sum().float().item()
-    return (intersection + SMOOTH) / (union + SMOOTH)
-
-def f1(outputImage, filename):
-    labelFilePath = os.path.join(labelDir, filename.replace("_sat.jpg", "_mask.png")) # Gives us labelDir/id_mask.png ( True Mask )
-    labelImage = cv2.imread(labelFilePath, cv2.IMREAD_GRAYSCALE)/255.0 # Reads labelDir/true_mask.png as grey scale
-    outputImage = cv2.cvtColor(outputImage, cv2.COLOR_BGR2GRAY)/255.0 # Convert RGB Numpy Output To GreyScale
-    # Convert to Tensor
-    labelImage = torch.from_numpy(labelImage)
-    outputImage = torch.from_numpy(outputImage)
-    # Thresh hold
-    labelRoad = labelImage >= 0.5
-    outputRoad = outputImage >= 0.5
-
-    labelBackground = labelImage < 0.5
-    outputBackground = outputImage < 0.5
-
-    TP = (labelRoad & outputRoad).int().sum().float().item()
-    FP = (labelBackground & outputRoad).int().sum().float().item()
-    FN = (labelRoad & outputBackground).int().sum().float().item()
-    return (SMOOTH + 2 * TP) / (SMOOTH + 2 * TP + FN + FP)
-
-def recall(outputImage, filename):
-    labelFilePath = os.path.join(labelDir, filename.replace("_sat.jpg", "_mask.png")) # Gives us labelDir/id_mask.png ( True Mask )
-    labelImage = cv2.imread(labelFilePath, cv2.IMREAD_GRAYSCALE)/255.0 # Reads labelDir/true_mask.png as grey scale
-    outputImage = cv2.cvtColor(outputImage, cv2.COLOR_BGR2GRAY)/255.0 # Convert RGB Numpy Output To GreyScale
-    # Convert to Tensor
-    labelImage = torch.from_numpy(labelImage)
-    outputImage = torch.from_numpy(outputImage)
-    # Thresh hold
-    labelRoad = labelImage >= 0.5
-    outputRoad = outputImage >= 0.5
-
-    labelBackground = labelImage < 0.5
-    outputBackground = outputImage < 0.5
-
-    TP = (labelRoad & outputRoad).int().sum().float().item()
-    FP = (labelBackground & outputRoad).int().sum().float().item()
-    FN = (labelRoad & outputBackground).int().sum().float().item()
-    return (SMOOTH + TP) / (SMOOTH + TP + FN)
-
-def precision(outputImage, filename):
-    labelFilePath = os.path.join(labelDir, filename.replace("_sat.jpg", "_mask.png")) # Gives us labelDir/id_mask.png ( True Mask )
-    labelImage = cv2.imread(labelFilePath, cv2.IMREAD_GRAYSCALE)/255.0 # Reads labelDir/true_mask.png as grey scale
-    outputImage = cv2.cvtColor(outputImage, cv2.COLOR_BGR2GRAY)/255.0 # Convert RGB Numpy Output To GreyScale
-    # Convert to Tensor
-    labelImage = torch.from_numpy(labelImage)
-    outputImage = torch.from_numpy(outputImage)
-    # Thresh hold
-    labelRoad = labelImage >= 0.5
-    outputRoad = outputImage >= 0.5
-
-    labelBackground = labelImage < 0.5
-    outputBackground = outputImage < 0.5
-
-    TP = (labelRoad & outputRoad).int().sum().float().item()
-    FP = (labelBackground & outputRoad).int().sum().float().item()
-    FN = (labelRoad & outputBackground).int().sum().float().item()
-    return (SMOOTH + TP) / (SMOOTH + TP + FP)
 
 class Dataset(data.Dataset):
 
@@ -113,10 +53,14 @@ args = parser.parse_args()
 
 args.stats = 30 if not args.stats else args.stats
 
-# Get Attributes From Modules
-model = importlib.import_module('networks.{}'.format(args.model))
+if not args.weights and not args.quantized and not os.path.isfile(args.model):
+    parser.error('one of -wt or -qt is required, unless the model is a pickled network')
+if args.quantized and args.compile:
+    parser.error('-cp does not apply to a -qt network')
 
-model = getattr(model, args.model)()
+# Get Attributes From Modules
+if not args.quantized:
+    model = networks.load(args.model)
 
 tester = importlib.import_module('testers.{}'.format('dinktta' if args.tta else 'tester'))
 tester = getattr(tester, 'dinktta' if args.tta else 'tester')
@@ -124,26 +68,46 @@ tester = getattr(tester, 'dinktta' if args.tta else 'tester')
 
 ids = [int(x) for x in args.devices.split(',')] if args.devices else None
 
-torch.cuda.set_device(ids[0])
-model = model.cuda()
-model = torch.nn.DataParallel(model, device_ids=ids)
-
-model.load_state_dict(torch.load(os.path.join('weights', args.weights), map_location={'cuda:2': 'cuda:0', 'cuda:3':'cuda:0'}))
+if args.quantized:
+    # Quantized kernels only run on the CPU, and prefer channels_last inputs
+    from quantize import loadQuantized
+    device = torch.device('cpu')
+    if args.tuned:
+        configureCpu(args.threads, args.interop)
+    memoryFormat = torch.channels_last
+    model = loadQuantized(args.quantized)
+else:
+    device = resolve(args.device, ids)
+    tuned = args.tuned and device.type == 'cpu'
+    if tuned:
+        configureCpu(args.threads, args.interop)
+    channelsLast = tuned or args.channelsLast
+    memoryFormat = torch.channels_last if channelsLast else torch.contiguous_format
+    model = place(model, device, ids if device.type == 'cuda' else None, channelsLast=channelsLast)
+
+    if args.weights:
+        loadState(model, torch.load(os.path.join('weights', args.weights), map_location=device))
+
+if args.compile:
+    # The testers always run the same batch shapes, so nothing needs padding here
+    from compiling import compileModel
+    model = compileModel(model, args.compile)
 
 dataset = Dataset(test=True, augment=None)
 
 testloader = torch.utils.data.DataLoader(
     dataset,
     batch_size=1,
-    shuffle=True)
+    shuffle=True,
+    **loaderOptions(device, args.workers, args.prefetch))
 
 print('Testing start')
 print('Arguments -> {}'.format(' '.join(sys.argv)))
 
 model.eval()
-tester = tester(model, batchsize=8)
+tester = tester(model, batchsize=8, device=device, memoryFormat=memoryFormat, fused=not args.unfused)
 
-with torch.no_grad():
+with torch.inference_mode():
     miou        = 0
     mf1         = 0
     mprecision  = 0